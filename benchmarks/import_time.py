@@ -0,0 +1,54 @@
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+# modules each command must be able to import without loading HEAVY_MODULES
+COMMANDS = {
+    "cli": ["cli"],
+    "metadata": ["cli", "triangulation.metadata"],
+    "export": ["cli", "triangulation.export"],
+}
+HEAVY_MODULES = ("torch", "torchvision", "ultralytics", "cv2", "scipy")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(modules: list[str], repeat=3) -> dict:
+    """
+    Imports `modules` in fresh interpreters and returns the fastest import time
+    and the heavy modules that were loaded on the way
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(modules=modules, heavy=HEAVY_MODULES)],
+            cwd=REPO, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output))
+    return min(runs, key=lambda run: run["seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that light commands start without heavy imports.")
+    parser.add_argument("--budget", type=float, default=0.5, help="allowed import time in seconds")
+    args = parser.parse_args()
+
+    failed = False
+    for command, modules in COMMANDS.items():
+        result = measure(modules)
+        ok = result["seconds"] <= args.budget and not result["heavy"]
+        failed |= not ok
+        heavy = f", loads {', '.join(result['heavy'])}" if result["heavy"] else ""
+        print(f"{command:>10}: {result['seconds']:.3f}s{heavy} {'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
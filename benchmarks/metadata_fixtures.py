@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+from triangulation import metadata
+from triangulation.cache import metadata_cache
+from triangulation.metadata import DJIMetadata
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Laid out like the camera writes them: the XMP packet only has the
+# `drone-dji:` properties, focal length and image size are in the EXIF block.
+EXPECTED = {
+    "DJI_0001_V.JPG": DJIMetadata(
+        relative_altitude=35.2,
+        absolute_altitude=553.12,
+        yaw=-12.3,
+        pitch=-25.1,
+        roll=0.0,
+        latitude=48.18921,
+        longitude=11.56233,
+        focal_length=6.72,
+        image_width=4000,
+        image_height=3000,
+    ),
+}
+
+
+def check_fixtures() -> dict[str, str]:
+    """
+    Reads every fixture without exempi and returns the problems by file name,
+    so `read_metadata` is checked on the layout of real DJI images
+    """
+    file_to_dict, persist = metadata.file_to_dict, metadata_cache.persist
+    metadata.file_to_dict = None
+    # no sidecar next to the fixtures
+    metadata_cache.persist = False
+    problems = {}
+    try:
+        for name, expected in EXPECTED.items():
+            try:
+                result = metadata.read_metadata(FIXTURES / name)
+            except Exception as e:
+                problems[name] = f"{type(e).__name__}: {e}"
+                continue
+            if result != expected:
+                problems[name] = f"read {result}"
+    finally:
+        metadata.file_to_dict = file_to_dict
+        metadata_cache.persist = persist
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_fixtures()
+    for name in EXPECTED:
+        print(f"{name}: {problems.get(name, 'ok')}")
+    sys.exit(1 if problems else 0)
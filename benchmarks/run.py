@@ -0,0 +1,107 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+import numpy as np
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from object_detection import create_pairs, detect_images, filter_results_by_object_num, rank_pairs, to_image_pairs
+from triangulation.bbox import get_bbox_positions
+from triangulation.cache import metadata_cache
+from triangulation.export import write_file
+from triangulation.flight_planning import generate_flight_plan, Position
+from triangulation.instrumentation import instrumentation
+from triangulation.metadata import read_metadata
+from .synthetic import StubDetector, make_flight, write_images
+
+SIZES = (100, 1_000, 10_000)
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates"
+
+
+@contextmanager
+def _timer(timings: dict[str, float], name: str):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def run_benchmark(n_images: int, work_dir: str | Path, top_k=10, max_distance=10.0, pixel_noise=0.5, seed=0) -> dict:
+    """
+    Runs the pipeline from metadata to KMZ on a synthetic flight of `n_images`
+    images and returns the time of every stage and the error of the
+    triangulated target corners against the ground truth.
+    """
+    work_dir = Path(work_dir)
+    flight = make_flight(n_images, pixel_noise=pixel_noise, seed=seed)
+    paths = write_images(flight, work_dir / f"flight_{n_images}")
+    detector = StubDetector(paths, flight)
+    # every run starts without cached metadata
+    metadata_cache.clear()
+    instrumentation.reset()
+
+    timings: dict[str, float] = {}
+    with _timer(timings, "read_metadata"):
+        metadata = [read_metadata(path) for path in paths]
+    with _timer(timings, "detection"):
+        results = filter_results_by_object_num(detect_images(paths, "", cache=None, model=detector), min_num=0)
+    with _timer(timings, "create_pairs"):
+        pairs = create_pairs(results, max_distance=max_distance)
+    with _timer(timings, "ranking"):
+        ranked = [pairs[i] for i in rank_pairs(pairs, top_k=top_k)]
+    image_pairs = to_image_pairs(ranked, work_dir)
+    with _timer(timings, "get_bbox_positions"):
+        positions = get_bbox_positions(image_pairs)
+    first = metadata[paths.index(image_pairs[0][0][0])]
+    drone_position = Position(first.latitude, first.longitude, first.absolute_altitude)
+    with _timer(timings, "generate_flight_plan"):
+        flight_plan = generate_flight_plan(positions[0], positions[1], drone_position)
+    with _timer(timings, "write_file"):
+        write_file(flight_plan, work_dir / f"flight_{n_images}.kmz", template_dir=TEMPLATE_DIR)
+
+    errors = np.linalg.norm(positions - flight.corners, axis=1)
+    return {
+        "images": n_images,
+        "pairs": len(pairs),
+        "waypoints": len(flight_plan),
+        "timings": timings,
+        "corner_errors": errors.tolist(),
+        "counters": instrumentation.report()["counters"],
+    }
+
+
+def _print_results(results: list[dict]):
+    stages = list(results[0]["timings"])
+    print(f"{'images':>8} {'pairs':>9} " + " ".join(f"{stage:>20}" for stage in stages) + f" {'error [m]':>10}")
+    for result in results:
+        timings = " ".join(f"{result['timings'][stage]:>19.4f}s" for stage in stages)
+        print(f"{result['images']:>8} {result['pairs']:>9} {timings} {max(result['corner_errors']):>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the pipeline on synthetic DJI flights with a stubbed detector.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="number of images per flight")
+    parser.add_argument("--top-k", type=int, default=10, help="number of ranked pairs used for the triangulation")
+    parser.add_argument("--pixel-noise", type=float, default=0.5, help="standard deviation of the box corners in pixels")
+    parser.add_argument("--max-error", type=float, default=0.5, help="allowed corner error in meters")
+    parser.add_argument("--work-dir", help="folder for the synthetic images (default: a temporary folder)")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(args.work_dir or tmp_dir)
+        results = [
+            run_benchmark(n, work_dir, top_k=args.top_k, pixel_noise=args.pixel_noise)
+            for n in args.sizes
+        ]
+    _print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [result["images"] for result in results if max(result["corner_errors"]) > args.max_error]
+    if failed:
+        print(f"Corner error above {args.max_error} m for {failed} images")
+        sys.exit(1)
@@ -0,0 +1,212 @@
+import cv2
+import struct
+import numpy as np
+
+from dataclasses import dataclass
+from pathlib import Path
+from scipy.spatial.transform import Rotation as R
+
+from inference import Detection
+from triangulation.geodesy import enu_basis, ecef_to_wgs84, wgs84_to_ecef
+from triangulation.triangulate import K_MATRIX, DIST_COEFFS
+
+__all__ = [
+    "SyntheticFlight",
+    "StubDetector",
+    "make_flight",
+    "write_images",
+]
+
+ORIGIN = (48.1372, 11.5756, 520.0)  # latitude, longitude, altitude of the ground below the first image
+IMAGE_WIDTH = 4000
+IMAGE_HEIGHT = 3000
+FOCAL_LENGTH = (4500, 1000)  # millimeters as an EXIF rational
+
+XMP_TEMPLATE = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="DJI Meta Data"
+    xmlns:drone-dji="http://www.dji.com/drone-dji/1.0/"
+   drone-dji:AbsoluteAltitude="{absolute_altitude:+.6f}"
+   drone-dji:RelativeAltitude="{relative_altitude:+.6f}"
+   drone-dji:GpsLatitude="{latitude:.10f}"
+   drone-dji:GpsLongitude="{longitude:.10f}"
+   drone-dji:GimbalYawDegree="{yaw:+.8f}"
+   drone-dji:GimbalPitchDegree="{pitch:+.8f}"
+   drone-dji:GimbalRollDegree="{roll:+.8f}"/>
+ </rdf:RDF>
+</x:xmpmeta>"""
+
+
+@dataclass
+class SyntheticFlight:
+    """
+    Camera poses of a flight and the ground truth of its target.
+    `corners` are the ECEF (top left, bottom right) corners of the target,
+    `boxes[i]` is the (1, 4) xyxy box of the target in image `i`.
+    """
+    latitude: np.ndarray
+    longitude: np.ndarray
+    absolute_altitude: np.ndarray
+    relative_altitude: float
+    yaw: np.ndarray
+    pitch: np.ndarray
+    roll: np.ndarray
+    corners: np.ndarray
+    boxes: np.ndarray
+
+    def __len__(self):
+        return len(self.latitude)
+
+
+def _look_at(cameras: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Returns the world to camera rotations (x right, y down, z forward)
+    of cameras looking at `target`, without tilting the horizon
+    """
+    forward = target - cameras
+    forward /= np.linalg.norm(forward, axis=1, keepdims=True)
+    up = cameras / np.linalg.norm(cameras, axis=1, keepdims=True)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right, axis=1, keepdims=True)
+    down = np.cross(forward, right)
+    return np.stack((right, down, forward), axis=1)
+
+
+def make_flight(n_images: int, spacing=2.0, relative_altitude=30.0, target_distance=25.0,
+                target_size=(4.0, 6.0), pixel_noise=0.5, seed=0) -> SyntheticFlight:
+    """
+    Creates a flight of `n_images` images on a square grid with `spacing` meters
+    between images, `relative_altitude` meters above the ground. All images look
+    at a vertical target of `target_size` (width, height) meters standing
+    `target_distance` meters north of the grid. The target boxes are projected
+    with the calibrated camera model and get Gaussian `pixel_noise`.
+    """
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(n_images)))
+    grid = np.arange(n_images)
+    east = (grid % columns) * spacing
+    north = -(grid // columns) * spacing
+    cameras_enu = np.column_stack((east, north, np.full(n_images, relative_altitude)))
+
+    width, height = target_size
+    center_east = (columns - 1) * spacing / 2
+    corners_enu = np.array([
+        [center_east - width / 2, target_distance, height],
+        [center_east + width / 2, target_distance, 0.0],
+    ])
+    basis = enu_basis(ORIGIN[0], ORIGIN[1])
+    origin = wgs84_to_ecef(*ORIGIN)
+    cameras = cameras_enu @ basis + origin
+    corners = corners_enu @ basis + origin
+
+    rotations = _look_at(cameras, corners.mean(axis=0))
+    yaw, pitch, roll = R.from_matrix(rotations).as_euler('zyx', degrees=True).T
+    latitude, longitude, altitude = ecef_to_wgs84(cameras).T
+
+    boxes = np.empty((n_images, 4), dtype=np.float64)
+    for i in range(n_images):
+        rvec, _ = cv2.Rodrigues(rotations[i])
+        pixels, _ = cv2.projectPoints(corners - cameras[i], rvec, np.zeros(3), K_MATRIX, DIST_COEFFS)
+        boxes[i] = pixels.reshape(-1)
+    boxes += rng.normal(scale=pixel_noise, size=boxes.shape)
+
+    return SyntheticFlight(
+        latitude=latitude,
+        longitude=longitude,
+        absolute_altitude=altitude,
+        relative_altitude=relative_altitude,
+        yaw=yaw,
+        pitch=pitch,
+        roll=roll,
+        corners=corners,
+        boxes=boxes[:, None],
+    )
+
+
+def _app1(payload: bytes) -> bytes:
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def _exif_block() -> bytes:
+    """
+    Returns a little-endian EXIF block with the focal length and the image
+    size in the EXIF IFD. DJI cameras write these tags to EXIF only,
+    exempi merges them into XMP when reading.
+    """
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 12 + 4
+    rational = exif_ifd + 2 + 3 * 12 + 4
+    tiff = b"II*\x00" + struct.pack("<I", ifd0)
+    # IFD0 only points to the EXIF IFD
+    tiff += struct.pack("<HHHII", 1, 0x8769, 4, 1, exif_ifd) + struct.pack("<I", 0)
+    tiff += struct.pack("<H", 3)
+    tiff += struct.pack("<HHII", 0x920A, 5, 1, rational)  # FocalLength
+    tiff += struct.pack("<HHII", 0xA002, 4, 1, IMAGE_WIDTH)  # PixelXDimension
+    tiff += struct.pack("<HHII", 0xA003, 4, 1, IMAGE_HEIGHT)  # PixelYDimension
+    tiff += struct.pack("<I", 0) + struct.pack("<II", *FOCAL_LENGTH)
+    return b"Exif\x00\x00" + tiff
+
+
+def _jpeg_with_metadata(image: bytes, packet: str) -> bytes:
+    # the APP1 segments go right after the SOI marker, like in DJI images
+    segments = _app1(_exif_block()) + _app1(b"http://ns.adobe.com/xap/1.0/\x00" + packet.encode())
+    return image[:2] + segments + image[2:]
+
+
+def write_images(flight: SyntheticFlight, folder: str | Path) -> list[str]:
+    """
+    Writes one small JPEG per image of `flight` into `folder`, carrying the DJI
+    XMP tags of the pose and the EXIF tags of the camera. The pixels are a
+    placeholder, the tags claim the full sensor size. Returns the paths of the images.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    ok, encoded = cv2.imencode(".jpg", np.full((48, 64, 3), 127, dtype=np.uint8))
+    if not ok:
+        raise RuntimeError("Could not encode the placeholder image")
+    image = encoded.tobytes()
+
+    paths = []
+    for i in range(len(flight)):
+        packet = XMP_TEMPLATE.format(
+            absolute_altitude=flight.absolute_altitude[i],
+            relative_altitude=flight.relative_altitude,
+            latitude=flight.latitude[i],
+            longitude=flight.longitude[i],
+            yaw=flight.yaw[i],
+            pitch=flight.pitch[i],
+            roll=flight.roll[i],
+        )
+        path = folder / f"DJI_{i:05d}_V.JPG"
+        path.write_bytes(_jpeg_with_metadata(image, packet))
+        paths.append(str(path))
+    return paths
+
+
+class StubDetector:
+    """
+    Stands in for the YOLO backends: returns the ground truth boxes of
+    a synthetic flight, with a confidence that drops with the box size.
+    Has the same `predict` interface as `InferenceBackend`, `batch` is only
+    used by the pipelined executor.
+    """
+
+    def __init__(self, paths: list[str], flight: SyntheticFlight, batch=8):
+        self.batch = batch
+        boxes = flight.boxes.astype(np.float32)
+        areas = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+        confidences = (0.5 + 0.5 * areas / areas.max()).astype(np.float32)
+        self._detections = {
+            path: (boxes[i], confidences[i]) for i, path in enumerate(paths)
+        }
+
+    def predict(self, paths: list[str]):
+        for path in paths:
+            xyxy, conf = self._detections[path]
+            yield Detection(path, xyxy.copy(), conf.copy(), np.zeros(len(conf), dtype=np.int16))
+
+    def load(self, path: str):
+        return None
+
+    def predict_loaded(self, paths: list[str], loaded: list) -> list[Detection]:
+        return list(self.predict(paths))
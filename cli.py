@@ -0,0 +1,173 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+from contextlib import nullcontext
+from dataclasses import asdict
+from pathlib import Path
+
+# Only light modules are imported here. Every command imports what it needs,
+# so e.g. `metadata` and `export` never load torch, cv2 or scipy.
+from inference import BACKENDS, TOP_K
+from triangulation.instrumentation import instrumentation
+
+
+def _read_waypoints(path: str) -> list[list[float]]:
+    """
+    Reads (latitude, longitude, altitude) rows from a CSV file (with or without
+    header) or a JSON list
+    """
+    if Path(path).suffix.lower() == ".json":
+        with open(path) as f:
+            return [[float(value) for value in row] for row in json.load(f)]
+    with open(path, newline="") as f:
+        rows = [row for row in csv.reader(f) if row]
+    if rows and not rows[0][0].lstrip("+-").replace(".", "", 1).isdigit():
+        rows = rows[1:]
+    return [[float(value) for value in row[:3]] for row in rows]
+
+
+def metadata_command(args):
+    from triangulation.metadata import read_metadata
+
+    entries = [{"path": path, **asdict(read_metadata(path))} for path in args.images]
+    print(json.dumps(entries, indent=2))
+
+
+def export_command(args):
+    from triangulation.export import write_file
+
+    write_file(_read_waypoints(args.waypoints), args.output, template_dir=args.templates)
+    print(f"Wrote {args.output}")
+
+
+def _store(args):
+    if args.store is None:
+        return None
+    from triangulation.store import ResultStore
+
+    return ResultStore(args.store)
+
+
+def plan_command(args):
+    if args.pipelined:
+        from pipeline import pipelined_flight_plan
+
+        image_pairs = pipelined_flight_plan(args.folder, args.model, args.output, backend=args.backend,
+                                            threads=args.threads, top_k=args.top_k, store=_store(args))
+    else:
+        from object_detection import get_image_pairs_and_detections
+        from triangulation.main import write_flight_plan
+
+        image_pairs, detections = get_image_pairs_and_detections(args.folder, args.model, backend=args.backend,
+                                                                 threads=args.threads, top_k=args.top_k)
+        if image_pairs:
+            write_flight_plan(image_pairs, args.output, store=_store(args), detections=detections)
+    if not image_pairs:
+        sys.exit("No image pairs found")
+    print(f"Wrote {args.output} from {len(image_pairs)} image pairs")
+
+
+def _write_unpaired(path: str, located: dict):
+    """
+    Writes the single-image positions of `geolocate_unpaired` as CSV
+    """
+    columns = ("path", "latitude", "longitude", "min_distance", "max_distance")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(zip(*(located[column] for column in columns)))
+
+
+def targets_command(args):
+    from object_detection import detect_oois, filter_results_by_object_num, geolocate_unpaired
+    from triangulation.main import write_targets_flight_plan
+
+    results = filter_results_by_object_num(
+        detect_oois(args.folder, args.model, backend=args.backend, threads=args.threads), min_num=0
+    )
+    if not results:
+        sys.exit("No objects detected")
+    positions, target_of = write_targets_flight_plan([r.path for r in results], [r.xyxy for r in results], args.output,
+                                          max_workers=args.workers or None, store=_store(args),
+                                          max_distance=args.max_distance, max_gap=args.max_gap)
+    print(f"Wrote {args.output} for {len(positions)} objects")
+    if args.unpaired:
+        located = geolocate_unpaired(results, target_of)
+        _write_unpaired(args.unpaired, located)
+        print(f"Wrote {args.unpaired} for {len(located['path'])} objects seen in a single image")
+
+
+def watch_command(args):
+    from watch import watch_folder
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    watch_folder(args.folder, args.model, args.output, backend=args.backend,
+                 threads=args.threads, poll_interval=args.poll_interval)
+
+
+def _add_detection_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("folder", help="folder with the drone images")
+    parser.add_argument("--model", default="model/best.pt")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default="output.kmz")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Detects objects in drone images and plans flights around them.")
+    parser.add_argument("--verbose", action="store_true", help="print debug output")
+    parser.add_argument("--report", help="write the time per stage and the counters as JSON")
+    parser.add_argument("--profile", help="write cProfile stats of the whole command")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser("plan", help="flight plan from the best ranked image pairs")
+    _add_detection_arguments(plan)
+    plan.add_argument("--top-k", type=int, default=TOP_K, help=f"number of best pairs used (default: {TOP_K})")
+    plan.add_argument("--store", help="results store to append the run to")
+    plan.add_argument("--pipelined", action="store_true",
+                      help="overlap metadata reads, decoding and inference (see pipeline.py)")
+    plan.set_defaults(run=plan_command)
+
+    targets = commands.add_parser("targets", help="one flight plan covering every detected object")
+    _add_detection_arguments(targets)
+    targets.add_argument("--workers", type=int, default=1,
+                         help="processes that triangulate the objects, 0 for one per core (default: 1)")
+    targets.add_argument("--store", help="results store to append the run to")
+    targets.add_argument("--max-distance", type=float, default=10.0,
+                         help="largest distance in m between two cameras that see the same object")
+    targets.add_argument("--max-gap", type=float, default=1.0,
+                         help="largest gap in m between two bearing rays of the same object")
+    targets.add_argument("--unpaired", help="write the single-image positions of the objects that were "
+                                            "not localized from several images as CSV")
+    targets.set_defaults(run=targets_command)
+
+    watch = commands.add_parser("watch", help="update the flight plan while images arrive")
+    _add_detection_arguments(watch)
+    watch.add_argument("--poll-interval", type=float, default=2.0)
+    watch.set_defaults(run=watch_command)
+
+    metadata = commands.add_parser("metadata", help="print the DJI metadata of images as JSON")
+    metadata.add_argument("images", nargs="+")
+    metadata.set_defaults(run=metadata_command)
+
+    export = commands.add_parser("export", help="write a KMZ from existing waypoints")
+    export.add_argument("waypoints", help="CSV or JSON file with latitude, longitude, altitude rows")
+    export.add_argument("--output", default="output.kmz")
+    export.add_argument("--templates", default=None, help="template folder (default: ./templates)")
+    export.set_defaults(run=export_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    instrumentation.verbose = instrumentation.verbose or args.verbose
+    with instrumentation.profile(args.profile) if args.profile else nullcontext():
+        args.run(args)
+    if args.report:
+        instrumentation.write_report(args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import atexit
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from inference import Detection
+from triangulation.cache import MetadataCache
+
+__all__ = [
+    "DetectionCache",
+    "content_hash",
+]
+
+CACHE_DIR_NAME = ".detections"
+# part of the key, detections of full resolution decodes are not reused
+DECODE_MODE = "reduced"
+
+# image path -> content hash, invalidated by size and mtime like the metadata cache
+_content_hashes = MetadataCache(sidecar_name=".content_hashes.json")
+atexit.register(_content_hashes.flush)
+
+
+def _hash_file(path: Path) -> dict[str, str]:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest()}
+
+
+def content_hash(image_path: str | Path) -> str:
+    """
+    Returns the SHA-256 of the image contents.
+    The hash is remembered per path, size and mtime, so unchanged images
+    are only hashed once.
+    """
+    return _content_hashes.get(image_path, _hash_file)["sha256"]
+
+
+class DetectionCache:
+    """
+    Content-addressed store of detection results.
+    An entry is keyed by the image contents, the model weights and the
+    inference settings, and stored as a (N, 6) float32 array of
+    x1, y1, x2, y2, confidence and class.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        self.cache_dir = Path(cache_dir)
+
+    @classmethod
+    def for_folder(cls, folder_path: str | Path) -> "DetectionCache":
+        return cls(Path(folder_path) / CACHE_DIR_NAME)
+
+    def key(self, image_path: str | Path, weights: str, backend: str, imgsz: int, conf: float, iou: float,
+            decode=DECODE_MODE) -> str:
+        text = f"{content_hash(image_path)}:{weights}:{backend}:{imgsz}:{conf}:{iou}:{decode}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.npy"
+
+    def load(self, key: str, image_path: str) -> Detection | None:
+        """
+        Returns the cached detection or None on a cache miss
+        """
+        try:
+            data = np.load(self._path(key))
+        except (OSError, ValueError):
+            return None
+        return Detection(image_path, data[:, :4].copy(), data[:, 4].copy(), data[:, 5].astype(np.int16))
+
+    def store(self, key: str, detection: Detection):
+        data = np.column_stack((detection.xyxy, detection.conf, detection.cls)).astype(np.float32)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,352 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from triangulation.images import IMAGE_SUFFIXES, REDUCED_FLAGS
+from triangulation.xmp import read_jpeg_size
+
+__all__ = [
+    "Detection",
+    "InferenceBackend",
+    "load_backend",
+    "export_model",
+    "weights_hash",
+    "list_images",
+    "read_image",
+    "prepare_image",
+    "BACKENDS",
+]
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+# detection defaults shared by all backends
+IMGSZ = 640
+CONF = 0.25
+IOU = 0.45
+MAX_DET = 300
+LETTERBOX_COLOR = 114
+# number of best ranked pairs a flight plan is triangulated from
+TOP_K = 10
+
+
+class Detection:
+    """
+    Compact detection result of a single image.
+    Only the boxes (`xyxy`), their confidences and classes are kept as
+    NumPy arrays, the decoded image of the `Results` object is dropped.
+    """
+    __slots__ = ("path", "xyxy", "conf", "cls")
+
+    def __init__(self, path: str, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.path = path
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    @classmethod
+    def from_result(cls, result) -> "Detection":
+        """
+        Converts an ultralytics `Results` object
+        """
+        boxes = result.boxes
+        return cls(
+            result.path,
+            boxes.xyxy.cpu().numpy().astype(np.float32),
+            boxes.conf.cpu().numpy().astype(np.float32),
+            boxes.cls.cpu().numpy().astype(np.int16),
+        )
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __repr__(self):
+        return f"Detection(path={self.path!r}, boxes={len(self)})"
+
+
+def list_images(folder_path: str | Path) -> list[str]:
+    """
+    Returns the sorted paths of all images in `folder_path`
+    """
+    return sorted(
+        str(p) for p in Path(folder_path).iterdir()
+        if p.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def weights_hash(model_path: str | Path) -> str:
+    """
+    Returns a short content hash of the model weights
+    """
+    stat = os.stat(model_path)
+    return _file_hash(os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+
+
+def export_model(model_path: str | Path, backend: str, imgsz=IMGSZ) -> Path:
+    """
+    Exports the PyTorch weights to ONNX or OpenVINO IR.
+    The artifact is cached next to the weights, keyed by the weights hash,
+    so the export only runs once per model.
+    """
+    model_path = Path(model_path)
+    stem = f"{model_path.stem}.{weights_hash(model_path)}.{imgsz}"
+    if backend == "onnx":
+        target = model_path.with_name(f"{stem}.onnx")
+    elif backend == "openvino":
+        # ultralytics and OpenVINO expect the `_openvino_model` suffix
+        target = model_path.with_name(f"{stem}_openvino_model")
+    else:
+        raise ValueError(f"Cannot export to backend '{backend}'")
+    if target.exists():
+        return target
+
+    from ultralytics import YOLO
+    exported = YOLO(str(model_path)).export(format=backend, imgsz=imgsz, dynamic=True)
+    Path(exported).rename(target)
+    return target
+
+
+def read_image(path: str, imgsz=IMGSZ) -> tuple[np.ndarray, tuple[float, float], tuple[int, int]]:
+    """
+    Decodes a JPEG at the smallest libjpeg scale whose long side still
+    covers `imgsz`, so the model input is never upsampled. Other formats
+    are decoded at full size.
+    Returns the BGR image, the (x, y) scale from decoded to native pixels
+    and the native (height, width).
+    """
+    import cv2
+
+    size = read_jpeg_size(path)
+    flag = cv2.IMREAD_COLOR
+    if size is not None:
+        factor = next((f for f in sorted(REDUCED_FLAGS, reverse=True) if max(size) / f >= imgsz), 1)
+        if factor > 1:
+            flag = getattr(cv2, REDUCED_FLAGS[factor])
+    image = cv2.imread(path, flag)
+    if image is None:
+        raise FileNotFoundError(f"Image at path '{path}' could not be loaded.")
+    height, width = image.shape[:2]
+    if size is not None:
+        width, height = size
+        # the EXIF orientation is applied after decoding
+        if (width > height) != (image.shape[1] > image.shape[0]):
+            width, height = height, width
+    return image, (width / image.shape[1], height / image.shape[0]), (height, width)
+
+
+def prepare_image(path: str, imgsz=IMGSZ, letterbox=True):
+    """
+    Decodes one image for the model with `read_image` and letterboxes it
+    unless the model does that itself. Independent of the model, so it
+    may run on other threads ahead of the inference.
+    Returns the model input and the per-axis gain, the padding and the
+    native shape that map the model input back to native pixels.
+    """
+    image, (scale_x, scale_y), shape = read_image(path, imgsz)
+    if not letterbox:
+        return image, ((1 / scale_x, 1 / scale_y), (0, 0), shape)
+    padded, gain, pad = _letterbox(image, imgsz)
+    return padded, ((gain / scale_x, gain / scale_y), pad, shape)
+
+
+def _letterbox(image: np.ndarray, imgsz: int) -> tuple[np.ndarray, float, tuple[float, float]]:
+    """
+    Resizes `image` to fit into a `imgsz` square and pads the rest.
+    Returns the padded image, the scale and the (x, y) padding.
+    """
+    import cv2
+
+    height, width = image.shape[:2]
+    gain = min(imgsz / height, imgsz / width)
+    new_width, new_height = round(width * gain), round(height * gain)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+    top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+    left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                               value=(LETTERBOX_COLOR,) * 3)
+    return image, gain, (left, top)
+
+
+def _postprocess(output: np.ndarray, gain: tuple[float, float], pad: tuple[float, float], shape: tuple[int, int],
+                 conf: float, iou: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodes the raw YOLO output of one image (4 + classes, anchors)
+    into boxes in native image pixels, applying per-class NMS.
+    """
+    import cv2
+
+    scores = output[4:]
+    cls = scores.argmax(axis=0)
+    confidences = scores[cls, np.arange(scores.shape[1])]
+    keep = confidences >= conf
+    cx, cy, w, h = output[:4, keep]
+    cls, confidences = cls[keep], confidences[keep]
+    if not len(confidences):
+        empty = np.zeros(0, dtype=np.float32)
+        return empty.reshape(0, 4), empty, empty.astype(np.int16)
+
+    indices = cv2.dnn.NMSBoxesBatched(
+        np.column_stack((cx - w / 2, cy - h / 2, w, h)).tolist(),
+        confidences.tolist(), cls.tolist(), conf, iou, top_k=MAX_DET,
+    )
+    indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+    xyxy = np.column_stack((cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2))[indices]
+    xyxy = _to_native(xyxy, gain, pad, shape)
+    return (
+        xyxy.astype(np.float32),
+        confidences[indices].astype(np.float32),
+        cls[indices].astype(np.int16),
+    )
+
+
+def _to_native(xyxy: np.ndarray, gain: tuple[float, float], pad: tuple[float, float],
+               shape: tuple[int, int]) -> np.ndarray:
+    # undo letterboxing and reduced decoding
+    xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad[0]) / gain[0]).clip(0, shape[1])
+    xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad[1]) / gain[1]).clip(0, shape[0])
+    return xyxy
+
+
+class InferenceBackend:
+    """
+    Runs the detector on a list of images and yields `Detection` records
+    """
+
+    def __init__(self, imgsz=IMGSZ, conf=CONF, iou=IOU, batch=8):
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.batch = batch
+
+    def predict(self, paths: list[str]) -> Iterator[Detection]:
+        for start in range(0, len(paths), self.batch):
+            chunk = paths[start:start + self.batch]
+            yield from self.predict_loaded(chunk, [self.load(path) for path in chunk])
+
+    # whether `load` letterboxes the images or the model does it
+    letterbox = True
+
+    def load(self, path: str):
+        """
+        Decodes one image at reduced resolution, see `prepare_image`
+        """
+        return prepare_image(path, self.imgsz, letterbox=self.letterbox)
+
+    def predict_loaded(self, paths: list[str], loaded: list) -> list[Detection]:
+        """
+        Runs the model on one batch of images prepared by `load`
+        """
+        inputs = [padded for padded, _ in loaded]
+        # BGR HWC uint8 -> RGB NCHW float
+        batch = np.ascontiguousarray(np.stack(inputs)[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+        outputs = self._infer(batch)
+        return [
+            Detection(path, *_postprocess(output, gain, pad, shape, self.conf, self.iou))
+            for path, output, (_, (gain, pad, shape)) in zip(paths, outputs, loaded)
+        ]
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """
+    Runs the PyTorch weights through ultralytics
+    """
+
+    def __init__(self, model_path: str | Path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import torch
+        from ultralytics import YOLO
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(str(model_path))
+
+    # ultralytics letterboxes the decoded images itself
+    letterbox = False
+
+    def predict_loaded(self, paths: list[str], loaded: list) -> list[Detection]:
+        results = self.model.predict(source=[image for image, _ in loaded], imgsz=self.imgsz, conf=self.conf,
+                                     iou=self.iou, batch=self.batch)
+        detections = []
+        for path, result, (_, (gain, pad, shape)) in zip(paths, results, loaded):
+            detection = Detection.from_result(result)
+            detection.path = path
+            detection.xyxy = _to_native(detection.xyxy, gain, pad, shape)
+            detections.append(detection)
+        return detections
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Runs the exported ONNX model on the CPU with ONNX Runtime
+    """
+
+    def __init__(self, model_path: str | Path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(export_model(model_path, "onnx", self.imgsz)),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINOBackend(InferenceBackend):
+    """
+    Runs the exported OpenVINO IR on the CPU
+    """
+
+    def __init__(self, model_path: str | Path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import openvino as ov
+
+        model_dir = export_model(model_path, "openvino", self.imgsz)
+        core = ov.Core()
+        config = {"PERFORMANCE_HINT": "THROUGHPUT"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        model = core.read_model(str(next(model_dir.glob("*.xml"))))
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.output = self.compiled.output(0)
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.compiled(batch)[self.output]
+
+
+def load_backend(model_path: str | Path, backend="torch", threads=None, **kwargs) -> InferenceBackend:
+    """
+    Returns the inference backend `backend` (one of `BACKENDS`) for `model_path`.
+    `threads` sets the number of intra-op CPU threads.
+    """
+    if backend == "torch":
+        return TorchBackend(model_path, threads=threads, **kwargs)
+    if backend == "onnx":
+        return OnnxBackend(model_path, threads=threads, **kwargs)
+    if backend == "openvino":
+        return OpenVINOBackend(model_path, threads=threads, **kwargs)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
@@ -1,259 +1,262 @@
-from ultralytics import YOLO
-from typing import List, Tuple
-from itertools import combinations
-from ultralytics.engine.results import Results
-from libxmp.utils import file_to_dict
-from dataclasses import dataclass
-from decimal import Decimal, getcontext
+from typing import Iterator, List, Tuple
 from pathlib import Path
-from pyproj import Transformer
 import numpy as np
-from torchvision.ops import box_area
 import os
-import torch
 
-def predict_oois(folder_path: str, model_path: str) -> List[Results]:
-    model = YOLO(model_path)
-    
-    # run inference and dump only .txt files
-    results = model.predict(
-        source=folder_path,
-        imgsz=640,
-        conf=0.25,
-        iou=0.45,
-        # save_txt=True,               # ← write out labels in YOLO format
-        # project='.',                 # ← save into ./predictions/
-        # name='predictions',          
-        # exist_ok=True,               # ← overwrite if it already exists
-        # save=False                   # ← do NOT save annotated images
-    )
-    return results
+from triangulation.flight_table import FlightTable
+from triangulation.trigonometry import geolocate_detections
+from inference import Detection, InferenceBackend, load_backend, list_images, weights_hash, IMGSZ, CONF, IOU
+from detection_cache import DetectionCache
+from triangulation.instrumentation import instrumentation
 
-def filter_results_by_object_num(results: List[Results], min_num=0) -> List[Results]:
-    results_with_objects = []
-    for r in results:
-        # Count detections
-        count = len(r.boxes.data)
-
-        if count > min_num:
-            print(f"Detected {count} objects")
-            results_with_objects.append(r)
-        else:
-            print("No objects detected")
-    return results_with_objects
-
-def pair_by_box_counts(results: List[Results], tol=0) -> List[Tuple[Results, Results]]:
-    paired: List[Tuple[Results, Results]] = []
-    for r1, r2 in combinations(results, 2):
-        if abs(len(r1.boxes.data) - len(r2.boxes.data)) <= tol:
-            print('---------------')
-            print('r1 count:', len(r1.boxes.data))
-            print('r2 count:', len(r2.boxes.data))
-            print("is pair")
-            paired.append((r1, r2))
-    return paired
-
-@dataclass
-class DJIMetadata:
-    # relative_altitude: float
-    absolute_altitude: float
-    yaw: float
-    pitch: float
-    roll: float
-    latitude: Decimal
-    longitude: Decimal
-    focal_length: float
-    image_width: int
-    image_height: int
-
-DJI_KEY = "http://www.dji.com/drone-dji/1.0/"
-DJI_KEY_ALTERNATIVE = "http://www.uav.com/drone-dji/1.0/"  # sometimes this key is used
-EXIF_KEY = "http://ns.adobe.com/exif/1.0/"
-DJI_PREFIX = "drone-dji:"
-EXIF_PREFIX = "exif:"
-
-# RELATIVE_ALTITUDE = f"{DJI_PREFIX}RelativeAltitude"
-ABSOLUTE_ALTITUDE = f"{DJI_PREFIX}AbsoluteAltitude"
-YAW = f"{DJI_PREFIX}GimbalYawDegree"
-PITCH = f"{DJI_PREFIX}GimbalPitchDegree"
-ROLL = f"{DJI_PREFIX}GimbalRollDegree"
-LATITUDE = f"{DJI_PREFIX}GpsLatitude"
-LONGITUDE = f"{DJI_PREFIX}GpsLongitude"
-FOCAL_LENGTH = f"{EXIF_PREFIX}FocalLength"
-IMAGE_WIDTH = f"{EXIF_PREFIX}PixelXDimension"
-IMAGE_HEIGHT = f"{EXIF_PREFIX}PixelYDimension"
-PRECISION = 12
-
-getcontext().prec = PRECISION
-
-def _metadata_to_dict(metadata: list[tuple]) -> dict[str, str]:
+def detect_oois(folder_path: str, model_path: str, backend="torch", threads=None, cache=True) -> Iterator[Detection]:
     """
-    Parses the DJI metadata into a dictionary
+    Streams the detections of all images in `folder_path`.
+    Each result is converted into a `Detection` and released right away,
+    so memory stays flat regardless of the folder size.
+    `backend` selects the inference backend ("torch", "onnx" or "openvino"),
+    `threads` the number of CPU threads it may use.
+    With `cache`, detections are stored in `folder_path/.detections` and
+    only images that were not detected with the same model and settings
+    before are passed to the model.
     """
-    return {
-        entry[0]: entry[1] for entry in metadata
-    }
+    detection_cache = DetectionCache.for_folder(folder_path) if cache else None
+    yield from detect_images(list_images(folder_path), model_path, backend=backend,
+                             threads=threads, cache=detection_cache)
 
-def read_metadata(file_path: str | Path) -> DJIMetadata:
+def detect_images(paths: List[str], model_path: str, backend="torch", threads=None,
+                  cache: DetectionCache | None = None, model: InferenceBackend | None = None) -> Iterator[Detection]:
     """
-    Reads the relevant metadata from file
+    Streams the detections of `paths` in order, see `detect_oois`.
+    An already loaded `model` may be passed in, otherwise it is only
+    loaded if there is anything left to detect.
     """
-    xmp_data = file_to_dict(str(file_path))
-    # two different keys may be used to identify the data
-    if DJI_KEY in xmp_data:
-        dji_metadata = _metadata_to_dict(xmp_data[DJI_KEY])
-    else:
-        dji_metadata = _metadata_to_dict(xmp_data[DJI_KEY_ALTERNATIVE])
-    exif_metadata = _metadata_to_dict(xmp_data[EXIF_KEY])
-    return DJIMetadata(
-        # relative_altitude=float(dji_metadata[RELATIVE_ALTITUDE]),
-        absolute_altitude=float(dji_metadata[ABSOLUTE_ALTITUDE]),
-        yaw=float(dji_metadata[YAW]),
-        pitch=float(dji_metadata[PITCH]),
-        roll=float(dji_metadata[ROLL]),
-        latitude=Decimal(dji_metadata[LATITUDE]),
-        longitude=Decimal(dji_metadata[LONGITUDE]),
-        focal_length=float(eval(exif_metadata[FOCAL_LENGTH])),
-        image_width=int(exif_metadata[IMAGE_WIDTH]),
-        image_height=int(exif_metadata[IMAGE_HEIGHT])
-    )
+    if cache is None:
+        instrumentation.count("images", len(paths))
+        with instrumentation.stage("model_load"):
+            model = model or load_backend(model_path, backend=backend, threads=threads)
+        yield from _predict(model, paths)
+        return
 
-def latlong_in_geo(metadata: DJIMetadata):
-    # convert gps into x, y, z
-    transformer = Transformer.from_crs("epsg:4326", "epsg:4978")  # WGS84 to ECEF
-    x, y, z = transformer.transform(
-        metadata.latitude,
-        metadata.longitude,
-        metadata.absolute_altitude
-    )
-    return x, y, z
+    instrumentation.count("images", len(paths))
+    weights = weights_hash(model_path)
+    keys = [cache.key(path, weights, backend, IMGSZ, CONF, IOU) for path in paths]
+    cached = [cache.load(key, path) for key, path in zip(keys, paths)]
+    missing = [path for path, detection in zip(paths, cached) if detection is None]
+    instrumentation.count("detections_cached", len(paths) - len(missing))
+    instrumentation.trace(f"{len(paths) - len(missing)} of {len(paths)} detections cached")
 
-def calculate_distance_3d(x1, y1, z1, x2, y2, z2):
-    point1 = np.array((x1, y1, z1))
-    point2 = np.array((x2, y2, z2))
-    
-    # calculating Euclidean distance
-    # using linalg.norm()
-    return np.linalg.norm(point1 - point2)
+    detected = iter(())
+    if missing:
+        with instrumentation.stage("model_load"):
+            model = model or load_backend(model_path, backend=backend, threads=threads)
+        detected = _predict(model, missing)
+    for key, detection in zip(keys, cached):
+        if detection is None:
+            detection = next(detected)
+            cache.store(key, detection)
+        yield detection
 
-def filter_pairs_by_distance(result_pairs: List[Tuple[Results, Results]], min=0, max=10) -> List[Tuple[Results, Results]]:
-    filtered: List[Tuple[Results, Results]] = []
-    for r1, r2 in result_pairs:
-        meta1 = read_metadata(r1.path)
-        meta2 = read_metadata(r2.path)
-
-        p1 = latlong_in_geo(meta1)
-        p2 = latlong_in_geo(meta2)
+def _predict(model: InferenceBackend, paths: List[str]) -> Iterator[Detection]:
+    """
+    Streams the detections of `paths` from `model`, one per path.
+    Raises a RuntimeError if the backend yields fewer or more results.
+    """
+    detected = model.predict(paths)
+    for i, path in enumerate(paths):
+        with instrumentation.stage("detection"):
+            detection = next(detected, None)
+        if detection is None:
+            raise RuntimeError(f"Backend returned {i} detections for {len(paths)} images, "
+                               f"none for '{path}'")
+        yield detection
+    if next(detected, None) is not None:
+        raise RuntimeError(f"Backend returned more detections than the {len(paths)} images")
 
-        dist = calculate_distance_3d(*p1, *p2)
+def filter_results_by_object_num(results: Iterator[Detection], min_num=0) -> List[Detection]:
+    results_with_objects = []
+    for r in results:
+        # Count detections
+        count = len(r)
 
-        print('------------')
-        print('Distance:', dist)
+        if count > min_num:
+            instrumentation.trace(f"Detected {count} objects")
+            results_with_objects.append(r)
+        else:
+            instrumentation.trace("No objects detected")
+    instrumentation.count("images_with_objects", len(results_with_objects))
+    return results_with_objects
 
-        if dist >= min and dist <= max:
-            filtered.append((r1, r2))
+def pair_by_distance(results: List[Detection], min=0, max=10, table: FlightTable | None = None) -> List[Tuple[Detection, Detection]]:
+    """
+    Returns all pairs of images whose cameras are between `min` and `max` meters apart.
+    Only pairs within `max` are generated (KD-tree over the camera positions),
+    so the cost grows with the number of close pairs instead of all combinations.
+    """
+    from scipy.spatial import cKDTree
 
-    return filtered
+    if table is None:
+        table = FlightTable.from_paths([r.path for r in results])
+    positions = table.ecef[table.indices([r.path for r in results])]
+    index_pairs = cKDTree(positions).query_pairs(r=max, output_type='ndarray')
+    # same order as itertools.combinations
+    index_pairs = index_pairs[np.lexsort((index_pairs[:, 1], index_pairs[:, 0]))]
+    if min > 0:
+        distances = np.linalg.norm(positions[index_pairs[:, 0]] - positions[index_pairs[:, 1]], axis=1)
+        index_pairs = index_pairs[distances >= min]
+    return [(results[i], results[j]) for i, j in index_pairs]
 
-def create_pairs(results: List[Results]) -> List[Tuple[Results, Results]]:
-    count_pairs = pair_by_box_counts(results)
-    print('================')
-    print('Number of pairs by count:', len(count_pairs))
-    print('================')
-    filtered = filter_pairs_by_distance(count_pairs)
-    print('================')
+@instrumentation.timed("pairing")
+def create_pairs(results: List[Detection], min_distance=0, max_distance=10, tol=0) -> List[Tuple[Detection, Detection]]:
+    table = FlightTable.from_paths([r.path for r in results])
+    distance_pairs = pair_by_distance(results, min=min_distance, max=max_distance, table=table)
+    instrumentation.trace('================')
+    instrumentation.trace('Number of pairs by distance:', len(distance_pairs))
+    instrumentation.trace('================')
+    counts = np.array([(len(r1), len(r2)) for r1, r2 in distance_pairs], dtype=np.int64).reshape(-1, 2)
+    keep = np.abs(counts[:, 0] - counts[:, 1]) <= tol
+    filtered = [pair for pair, k in zip(distance_pairs, keep) if k]
+    instrumentation.trace('================')
+    instrumentation.count("pairs_considered", len(distance_pairs))
+    instrumentation.count("pairs_kept", len(filtered))
     return filtered 
 
-def get_avg_pair_conf(pair: Tuple[Results, Results]):
-    r1, r2 = pair
-    avg1 = r1.boxes.conf.mean()
-    avg2 = r2.boxes.conf.mean()
-    return (avg1 + avg2)
-
-def sort_by_conf(pairs: List[Tuple[Results, Results]]) -> List[Tuple[Results, Results]]:
-    return sorted(pairs, key=get_avg_pair_conf, reverse=True)
-
-def get_avg_box_size(r: Results):
-    areas = box_area(r.boxes.xyxy)
-    return areas.mean()
-
-def get_avg_pair_box_size(pair: Tuple[Results, Results]):
-    r1, r2 = pair
-    return get_avg_box_size(r1) + get_avg_box_size(r2)
-
-def sort_by_box_size(pairs: List[Tuple[Results, Results]]) -> List[Tuple[Results, Results]]:
-    return sorted(pairs, key=get_avg_pair_box_size, reverse=True)
-
-def combine_rankings_rrf(list1, list2, k: int = 60):
+def geolocate_unpaired(results: List[Detection], target_of: List[np.ndarray], table: FlightTable | None = None) -> dict[str, np.ndarray]:
     """
-    Combines two ranked lists using Reciprocal Rank Fusion (RRF).
+    Single-image geolocation of all detections that could not be localized
+    from several images. `target_of[i]` holds the object index of every box
+    of `results[i]` as returned by `localize_targets` (-1: not localized).
+    Returns the output of `geolocate_detections` plus the `path` of every detection.
     """
-    ranks1: Dict[Any, int] = {item: i for i, item in enumerate(list1)}
-    ranks2: Dict[Any, int] = {item: i for i, item in enumerate(list2)}
-    all_items: set = set(list1) | set(list2)
+    unpaired = [r.xyxy[np.asarray(t) < 0] for r, t in zip(results, target_of)]
+    paths = [r.path for r, boxes in zip(results, unpaired) if len(boxes)]
+    unpaired = [boxes for boxes in unpaired if len(boxes)]
+    if table is None:
+        table = FlightTable.from_paths(paths)
+    rows = np.repeat(table.indices(paths), [len(boxes) for boxes in unpaired])
+    centers_y = np.concatenate([(boxes[:, 1] + boxes[:, 3]) / 2 for boxes in unpaired]) if unpaired else np.zeros(0)
+    located = geolocate_detections(table, rows, centers_y)
+    located["path"] = np.array([table.paths[row] for row in rows], dtype=object)
+    return located
 
-    rrf_scores: Dict[Any, float] = {}
-    for item in all_items:
-        score = 0.0
-        rank1 = ranks1.get(item)
-        if rank1 is not None:
-            score += 1.0 / (k + rank1)
-        rank2 = ranks2.get(item)
-        if rank2 is not None:
-            score += 1.0 / (k + rank2)
-        rrf_scores[item] = score
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
 
-    return sorted(all_items, key=lambda item: rrf_scores[item], reverse=True)
+def get_avg_box_size(r: Detection):
+    areas = box_area(r.xyxy)
+    return areas.mean()
 
 def create_overall_bbox(boxes):
     x_min = boxes[:, 0].min()
     y_min = boxes[:, 1].min()
     x_max = boxes[:, 2].max()
     y_max = boxes[:, 3].max()
-    return torch.stack([x_min, y_min, x_max, y_max])
+    return np.array([x_min, y_min, x_max, y_max])
 
-def get_image_pairs(folder_path: str, model_path: str) -> List[Tuple[Tuple[str, any], Tuple[str, any]]]:
+@instrumentation.timed("ranking")
+def rank_pairs(pairs: List[Tuple[Detection, Detection]], top_k=None, k: int = 60) -> np.ndarray:
     """
-    - Runs object detection on all images in `folder_path` with the given YOLO `model_path`.
-    - Filters out images with no detections.
-    - Pairs images by object count and by GPS distance.
-    - Ranks pairs by confidence and box-size, then fuses the rankings.
-    - Returns a list of ((full_path1, bbox1), (full_path2, bbox2)) tuples.
+    Ranks pairs by average confidence and by average box size and fuses both
+    rankings with Reciprocal Rank Fusion, a pair scores 1 / (k + rank) per ranking.
+    All scores are computed as arrays, only the `top_k` best pairs (default: all)
+    are fully sorted. Returns the indices of the best pairs, best first.
     """
-    folder = Path(folder_path)
-    # 1) detect objects
-    results = predict_oois(str(folder), model_path)
+    if not pairs:
+        return np.zeros(0, dtype=np.intp)
+    # score every image once, pairs only index into it
+    images = list({id(r): r for pair in pairs for r in pair}.values())
+    image_index = {id(r): i for i, r in enumerate(images)}
+    avg_conf = np.array([r.conf.mean() for r in images], dtype=np.float64)
+    avg_size = np.array([get_avg_box_size(r) for r in images], dtype=np.float64)
+    first = np.array([image_index[id(r1)] for r1, _ in pairs], dtype=np.intp)
+    second = np.array([image_index[id(r2)] for _, r2 in pairs], dtype=np.intp)
+
+    fused = np.zeros(len(pairs), dtype=np.float64)
+    for score in (avg_conf[first] + avg_conf[second], avg_size[first] + avg_size[second]):
+        # stable, like `sorted(..., reverse=True)`
+        ranks = np.empty(len(pairs), dtype=np.float64)
+        ranks[np.argsort(-score, kind='stable')] = np.arange(len(pairs))
+        fused += 1.0 / (k + ranks)
+
+    if top_k is not None and top_k < len(pairs):
+        candidates = np.argpartition(-fused, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(pairs))
+    # ties are broken by the pair order
+    return candidates[np.lexsort((candidates, -fused[candidates]))]
+
+def iter_ranked_pairs(pairs: List[Tuple[Detection, Detection]], top_k=None) -> Iterator[Tuple[Detection, Detection]]:
+    """
+    Yields the `top_k` best pairs (default: all), best first
+    """
+    for idx in rank_pairs(pairs, top_k=top_k):
+        yield pairs[idx]
+
+def _iter_pairs(results: Iterator[Detection], folder: Path, top_k=None) -> Iterator[Tuple[Tuple[str, any], Tuple[str, any]]]:
     # 2) drop images with zero detections
     results = filter_results_by_object_num(results, min_num=1)
     # 3) get candidate pairs (by count & distance)
     pairs = create_pairs(results)
-    print("Number of pairs:", len(pairs))
-    # 4) rank by avg confidence and by avg box size
-    conf_sorted = sort_by_conf(pairs)
-    size_sorted = sort_by_box_size(pairs)
-    # 5) fuse the two rankings
-    fused = combine_rankings_rrf(conf_sorted, size_sorted)
-    # 6) print out for debugging
-    for idx, (r1, r2) in enumerate(fused):
-        print('====================')
-        print('Rank:', idx)
-        print('Image 1:', r1.path)
-        print('Image 2:', r2.path)
-    print('====================')
-    # 7) build the final list of (path, bbox) pairs, ensuring full paths
-    final_list: List[Tuple[Tuple[str, any], Tuple[str, any]]] = []
-    for r1, r2 in fused:
-        bbox1 = create_overall_bbox(r1.boxes.xyxy)
-        bbox2 = create_overall_bbox(r2.boxes.xyxy)
-        p1 = Path(r1.path)
-        p2 = Path(r2.path)
-        # if the detector returned only a basename or wrong path, anchor it under folder
-        if not p1.exists():
-            p1 = folder / p1.name
-        if not p2.exists():
-            p2 = folder / p2.name
-        final_list.append(
-            ((str(p1), bbox1),
-             (str(p2), bbox2))
-        )
-    return final_list
+    instrumentation.trace("Number of pairs:", len(pairs))
+    # 4) rank by avg confidence and by avg box size and fuse the two rankings
+    for idx, (r1, r2) in enumerate(iter_ranked_pairs(pairs, top_k=top_k)):
+        # 5) print out for debugging
+        instrumentation.trace('====================')
+        instrumentation.trace('Rank:', idx)
+        instrumentation.trace('Image 1:', r1.path)
+        instrumentation.trace('Image 2:', r2.path)
+        # 6) build the (path, bbox) pair, ensuring full paths
+        yield to_image_pair(r1, r2, folder)
+
+def iter_image_pairs(folder_path: str, model_path: str, backend="torch", threads=None, top_k=None) -> Iterator[Tuple[Tuple[str, any], Tuple[str, any]]]:
+    """
+    Lazy version of `get_image_pairs`.
+    Bounding boxes and paths are only built for the pairs that are consumed.
+    """
+    folder = Path(folder_path)
+    # 1) detect objects (streamed, only the boxes are kept)
+    results = detect_oois(str(folder), model_path, backend=backend, threads=threads)
+    yield from _iter_pairs(results, folder, top_k=top_k)
+
+def get_image_pairs(folder_path: str, model_path: str, backend="torch", threads=None, top_k=None) -> List[Tuple[Tuple[str, any], Tuple[str, any]]]:
+    """
+    - Runs object detection on all images in `folder_path` with the given YOLO `model_path` on the inference `backend`.
+    - Filters out images with no detections.
+    - Pairs images by object count and by GPS distance.
+    - Ranks pairs by confidence and box-size, then fuses the rankings.
+    - Returns a list of the `top_k` (default: all) best ((full_path1, bbox1), (full_path2, bbox2)) tuples.
+    """
+    return list(iter_image_pairs(folder_path, model_path, backend=backend, threads=threads, top_k=top_k))
+
+def get_image_pairs_and_detections(folder_path: str, model_path: str, backend="torch", threads=None,
+                                   top_k=None) -> Tuple[List[Tuple[Tuple[str, any], Tuple[str, any]]], List[Detection]]:
+    """
+    Like `get_image_pairs`, but also returns the detections of every image
+    (with full paths), e.g. to keep them in a `ResultStore`.
+    """
+    folder = Path(folder_path)
+    detections = [
+        Detection(_full_path(r.path, folder), r.xyxy, r.conf, r.cls)
+        for r in detect_oois(str(folder), model_path, backend=backend, threads=threads)
+    ]
+    return list(_iter_pairs(detections, folder, top_k=top_k)), detections
+
+def _full_path(path: str, folder: Path) -> str:
+    # if the detector returned only a basename or wrong path, anchor it under folder
+    p = Path(path)
+    return str(p if p.exists() else folder / p.name)
+
+def to_image_pair(r1: Detection, r2: Detection, folder: Path) -> Tuple[Tuple[str, any], Tuple[str, any]]:
+    """
+    Converts a detection pair into a ((full_path1, bbox1), (full_path2, bbox2)) tuple
+    """
+    bbox1 = create_overall_bbox(r1.xyxy)
+    bbox2 = create_overall_bbox(r2.xyxy)
+    return ((_full_path(r1.path, folder), bbox1),
+            (_full_path(r2.path, folder), bbox2))
+
+def to_image_pairs(pairs: List[Tuple[Detection, Detection]], folder: Path) -> List[Tuple[Tuple[str, any], Tuple[str, any]]]:
+    """
+    Converts detection pairs into ((full_path1, bbox1), (full_path2, bbox2)) tuples
+    """
+    return [to_image_pair(r1, r2, folder) for r1, r2 in pairs]
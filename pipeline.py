@@ -0,0 +1,292 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from inference import Detection, InferenceBackend, load_backend, list_images, prepare_image, weights_hash, IMGSZ, CONF, IOU, TOP_K
+from detection_cache import DetectionCache
+from object_detection import create_overall_bbox, iter_ranked_pairs, to_image_pairs
+from watch import IncrementalPairer
+from triangulation.bbox import bbox_views, solve_bbox
+from triangulation.flight_table import FlightTable
+from triangulation.geodesy import wgs84_to_ecef
+from triangulation.instrumentation import instrumentation
+from triangulation.metadata import DJIMetadata, read_metadata
+from triangulation.main import write_flight_plan
+from triangulation.store import ResultStore
+
+__all__ = [
+    "PipelineResult",
+    "run_pipeline",
+    "pipelined_flight_plan",
+]
+
+# marks the end of a queue
+DONE = None
+
+PipelineResult = Tuple[List[Tuple[Tuple[str, any], Tuple[str, any]]], FlightTable, List[Detection], np.ndarray | None]
+
+
+async def _run_in(executor: ThreadPoolExecutor, function, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+async def run_pipeline(
+    folder_path: str,
+    model_path: str,
+    backend="torch",
+    threads=None,
+    top_k=TOP_K,
+    cache=True,
+    model: InferenceBackend | None = None,
+    io_workers=8,
+    decode_workers=None,
+    queue_size=32,
+) -> PipelineResult:
+    """
+    Pipelined version of `get_image_pairs`, returning the same `top_k`
+    (default: `TOP_K`) best pairs.
+    The stages run concurrently and are connected by bounded queues:
+    - `io_workers` threads read the metadata and look up cached detections,
+      running ahead of the inference,
+    - `decode_workers` threads (default: one per core) decode the images that
+      were not detected before at reduced resolution and letterbox them,
+      without waiting for the model,
+    - one thread runs the model on batches of decoded images while the model
+      itself is loaded in parallel to the first reads,
+    - pairing happens on the event loop as soon as an image has both its
+      metadata and its detections,
+    - one thread prepares the triangulation of every image as soon as it is
+      part of a pair (see `bbox_views`), so after the last detection only the
+      final solve over the ranked pairs is left.
+    `queue_size` bounds the number of images waiting between two stages, so
+    memory stays flat. Like `get_image_pairs`, only the images with enough
+    detections to be paired need DJI metadata. Returns the pairs, a
+    `FlightTable` of the pairable images, the detections of all images
+    in folder order and the triangulated bbox corners of the pairs (None
+    without pairs, see `get_bbox_positions`).
+    """
+    folder = Path(folder_path)
+    paths = list_images(folder)
+    order = {path: i for i, path in enumerate(paths)}
+    detection_cache = DetectionCache.for_folder(folder) if cache else None
+    weights = weights_hash(model_path) if detection_cache is not None else None
+    decode_workers = decode_workers or os.cpu_count() or 1
+
+    metadata: dict[str, DJIMetadata] = {}
+    # images without DJI metadata only fail the run if they would be paired
+    metadata_errors: dict[str, Exception] = {}
+    detections: dict[str, Detection] = {}
+    keys: dict[str, str] = {}
+    pairer = IncrementalPairer()
+    # projection matrix and undistorted bbox corners of every paired image
+    views: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+    queued: set[str] = set()
+
+    path_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    decode_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    infer_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    # only holds paths, pairing must never wait for the triangulation
+    triangulate_queue: asyncio.Queue = asyncio.Queue()
+
+    io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="pipeline-io")
+    decode_pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="pipeline-decode")
+    model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-model")
+    triangulate_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-triangulate")
+    model_future = None
+    # decoding only depends on the input size, it does not wait for the model
+    # (ultralytics letterboxes the images itself, see `TorchBackend.letterbox`)
+    load = model.load if model is not None else partial(prepare_image, imgsz=IMGSZ, letterbox=backend != "torch")
+
+    def get_model() -> asyncio.Future:
+        # the model is only loaded once the first image needs it
+        nonlocal model_future
+        if model_future is None:
+            if model is not None:
+                model_future = asyncio.get_running_loop().create_future()
+                model_future.set_result(model)
+            else:
+                model_future = asyncio.ensure_future(
+                    _run_in(model_pool, lambda: load_backend(model_path, backend=backend, threads=threads))
+                )
+        return model_future
+
+    def join(path: str):
+        # an image is paired once its metadata and detections are in
+        if path in metadata_errors and path in detections:
+            if len(detections[path]) > pairer.min_num:
+                # `get_image_pairs` fails on this image as well
+                raise metadata_errors[path]
+        elif path in metadata and path in detections:
+            m = metadata[path]
+            position = wgs84_to_ecef(m.latitude, m.longitude, m.absolute_altitude)
+            new_pairs = pairer.add(detections[path], position=position)
+            # both images of a new pair can be triangulated from now on
+            for pair in pairer.pairs[len(pairer.pairs) - new_pairs:]:
+                for r in pair:
+                    if r.path not in queued:
+                        queued.add(r.path)
+                        triangulate_queue.put_nowait(r.path)
+
+    # the stages are timed on the executor threads, the coroutines of the
+    # event loop thread would interleave their stage stacks
+    def decode(path: str):
+        with instrumentation.stage("pipeline_decode"):
+            return load(path)
+
+    def infer(backend_model: InferenceBackend, paths: list[str], loaded: list) -> list[Detection]:
+        with instrumentation.stage("pipeline_inference"):
+            return backend_model.predict_loaded(paths, loaded)
+
+    def prepare(batch: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        with instrumentation.stage("pipeline_triangulation"):
+            table = FlightTable.from_metadata(batch, [metadata[path] for path in batch])
+            P, pixels = bbox_views(table, np.arange(len(batch)),
+                                   [create_overall_bbox(detections[path].xyxy) for path in batch])
+            return list(zip(P, pixels))
+
+    def lookup(path: str) -> tuple[DJIMetadata | Exception, Detection | None]:
+        with instrumentation.stage("pipeline_io"):
+            try:
+                m = read_metadata(path)
+            except Exception as e:
+                m = e
+            if detection_cache is None:
+                return m, None
+            keys[path] = detection_cache.key(path, weights, backend, IMGSZ, CONF, IOU)
+            return m, detection_cache.load(keys[path], path)
+
+    async def produce():
+        for path in paths:
+            await path_queue.put(path)
+        for _ in range(io_workers):
+            await path_queue.put(DONE)
+
+    async def io_worker():
+        while (path := await path_queue.get()) is not DONE:
+            m, detection = await _run_in(io_pool, lookup, path)
+            if isinstance(m, Exception):
+                metadata_errors[path] = m
+            else:
+                metadata[path] = m
+            if detection is None:
+                get_model()
+                await decode_queue.put(path)
+            else:
+                instrumentation.count("detections_cached")
+                detections[path] = detection
+            join(path)
+
+    async def decode_worker():
+        while (path := await decode_queue.get()) is not DONE:
+            loaded = await _run_in(decode_pool, decode, path)
+            await infer_queue.put((path, loaded))
+
+    async def infer_worker():
+        finished = False
+        while not finished:
+            batch = []
+            backend_model = None
+            while not finished and (backend_model is None or len(batch) < backend_model.batch):
+                item = await infer_queue.get()
+                if item is DONE:
+                    finished = True
+                    break
+                batch.append(item)
+                backend_model = await get_model()
+            if not batch:
+                continue
+            batch_paths = [path for path, _ in batch]
+            results = await _run_in(model_pool, infer, backend_model, batch_paths, [loaded for _, loaded in batch])
+            for path, detection in zip(batch_paths, results):
+                detections[path] = detection
+                if detection_cache is not None:
+                    await _run_in(io_pool, detection_cache.store, keys[path], detection)
+                join(path)
+
+    async def triangulate_worker():
+        finished = False
+        while not finished:
+            # everything that was paired while the last batch was prepared
+            batch = [await triangulate_queue.get()]
+            while not triangulate_queue.empty():
+                batch.append(triangulate_queue.get_nowait())
+            if DONE in batch:
+                finished = True
+                batch = [path for path in batch if path is not DONE]
+            if batch:
+                views.update(zip(batch, await _run_in(triangulate_pool, prepare, batch)))
+
+    async def stage(workers: list, then):
+        await asyncio.gather(*workers)
+        await then()
+
+    async def close(queue: asyncio.Queue, count: int):
+        for _ in range(count):
+            await queue.put(DONE)
+
+    instrumentation.count("images", len(paths))
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in (
+        produce(),
+        stage([io_worker() for _ in range(io_workers)], lambda: close(decode_queue, decode_workers)),
+        stage([decode_worker() for _ in range(decode_workers)], lambda: close(infer_queue, 1)),
+        # the inference finishes last, after it nothing is paired anymore
+        stage([infer_worker()], lambda: close(triangulate_queue, 1)),
+        triangulate_worker(),
+    )]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # stop the other stages before their pools go away
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        for pool in (io_pool, decode_pool, model_pool, triangulate_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # images finish out of order, sort the pairs like `create_pairs` does
+    pairs = [tuple(sorted(pair, key=lambda r: order[r.path])) for pair in pairer.pairs]
+    pairs.sort(key=lambda pair: (order[pair[0].path], order[pair[1].path]))
+    instrumentation.count("pairs_kept", len(pairs))
+    ranked = list(iter_ranked_pairs(pairs, top_k=top_k))
+    image_pairs = to_image_pairs(ranked, folder)
+    # only the paired images need their metadata
+    joined = sorted((d.path for d in pairer.detections), key=order.get)
+    table = FlightTable.from_metadata(joined, [metadata[path] for path in joined])
+    bbox_positions = None
+    if ranked:
+        # every image only counts once, like in `get_bbox_positions`
+        with instrumentation.stage("triangulation"):
+            ranked_views = [views[path] for path in dict.fromkeys(r.path for pair in ranked for r in pair)]
+            bbox_positions = solve_bbox(np.stack([P for P, _ in ranked_views]),
+                                        np.stack([pixels for _, pixels in ranked_views]))
+    return image_pairs, table, [detections[path] for path in paths], bbox_positions
+
+
+def pipelined_flight_plan(
+    folder_path: str,
+    model_path: str,
+    output_file="output.kmz",
+    backend="torch",
+    threads=None,
+    top_k=TOP_K,
+    store: ResultStore | None = None,
+    **kwargs,
+) -> List[Tuple[Tuple[str, any], Tuple[str, any]]]:
+    """
+    Runs `run_pipeline` and writes the flight plan of the ranked pairs to `output_file`,
+    reusing the metadata and the triangulation of the pipeline. Returns the image pairs.
+    """
+    image_pairs, table, detections, bbox_positions = asyncio.run(
+        run_pipeline(folder_path, model_path, backend=backend, threads=threads, top_k=top_k, **kwargs)
+    )
+    if image_pairs:
+        write_flight_plan(image_pairs, output_file, store=store, table=table, detections=detections,
+                          bbox_positions=bbox_positions)
+    return image_pairs
@@ -0,0 +1,176 @@
+import numpy as np
+
+from .flight_table import FlightTable
+from .instrumentation import instrumentation
+from .parallel import build_target_jobs, localize_jobs
+from .triangulate import compute_camera_matrices, undistort_points, triangulate_observations
+
+__all__ = [
+    "bearing_rays",
+    "ray_distances",
+    "associate_detections",
+    "group_targets",
+    "localize_targets",
+]
+
+# cost of an impossible match
+NO_MATCH = 1e9
+
+
+def bearing_rays(table: FlightTable, rows, pixels) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the camera centers and unit viewing directions (ECEF) of
+    pixels with shape (N, 2), seen from the images `rows` of `table`.
+    Both are derived from the projection matrices of `compute_camera_matrices`.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    P, K = compute_camera_matrices(table, rows)
+    M = P[:, :, :3]
+    homogeneous = np.column_stack((undistort_points(pixels, K), np.ones(len(rows))))
+    directions = np.linalg.solve(M, homogeneous[:, :, None])[..., 0]
+    origins = -np.linalg.solve(M, P[:, :, 3:])[..., 0]
+    return origins, directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+def ray_distances(origins1, directions1, origins2, directions2) -> np.ndarray:
+    """
+    Returns the closest distance between every ray of the first and every ray
+    of the second set as an (N1, N2) matrix. Rays that only meet behind
+    one of the cameras get the cost `NO_MATCH`.
+    """
+    w0 = origins1[:, None] - origins2[None]
+    b = directions1 @ directions2.T
+    d = np.einsum('ik,ijk->ij', directions1, w0)
+    e = np.einsum('jk,ijk->ij', directions2, w0)
+    denom = 1.0 - b ** 2
+    parallel = denom < 1e-12
+    denom = np.where(parallel, 1.0, denom)
+    t = np.where(parallel, 0.0, (b * e - d) / denom)
+    s = np.where(parallel, e, (e - b * d) / denom)
+    gap = w0 + t[..., None] * directions1[:, None] - s[..., None] * directions2[None]
+    distances = np.linalg.norm(gap, axis=-1)
+    return np.where((t >= 0) & (s >= 0), distances, NO_MATCH)
+
+
+def _find(parents: np.ndarray, i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+@instrumentation.timed("association")
+def associate_detections(
+    table: FlightTable,
+    rows: np.ndarray,
+    boxes: list[np.ndarray],
+    max_baseline=10.0,
+    max_gap=1.0,
+) -> list[np.ndarray]:
+    """
+    Groups the detections of many images into objects.
+    `boxes[i]` holds the (n, 4) xyxy boxes of image `rows[i]`.
+    Detections of two images whose cameras are at most `max_baseline` meters
+    apart are matched by the distance of their bearing rays (box centers),
+    using an assignment solver on the cost matrix. Matches with a gap above
+    `max_gap` meters are rejected. Matches are merged into tracks, with at most
+    one detection per image and track.
+    Returns the track id of every box, per image.
+    """
+    from scipy.optimize import linear_sum_assignment
+    from scipy.spatial import cKDTree
+
+    rows = np.asarray(rows, dtype=np.intp)
+    counts = np.array([len(b) for b in boxes], dtype=np.intp)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    if not offsets[-1]:
+        return [np.zeros(0, dtype=np.intp) for _ in boxes]
+    all_boxes = np.concatenate(boxes).reshape(-1, 4)
+    image_of = np.repeat(np.arange(len(boxes)), counts)
+    centers = (all_boxes[:, :2] + all_boxes[:, 2:]) / 2
+    origins, directions = bearing_rays(table, rows[image_of], centers)
+
+    # candidate matches of all image pairs within the baseline
+    matches = []
+    image_pairs = cKDTree(table.ecef[rows]).query_pairs(r=max_baseline, output_type='ndarray')
+    for a, b in image_pairs[np.lexsort((image_pairs[:, 1], image_pairs[:, 0]))]:
+        if not counts[a] or not counts[b]:
+            continue
+        sa, sb = slice(offsets[a], offsets[a + 1]), slice(offsets[b], offsets[b + 1])
+        cost = ray_distances(origins[sa], directions[sa], origins[sb], directions[sb])
+        for i, j in zip(*linear_sum_assignment(cost)):
+            if cost[i, j] <= max_gap:
+                matches.append((cost[i, j], offsets[a] + i, offsets[b] + j))
+
+    # merge the best matches first, never two detections of one image into a track
+    parents = np.arange(offsets[-1])
+    images = {i: {image_of[i]} for i in range(offsets[-1])}
+    for _, i, j in sorted(matches):
+        root_i, root_j = _find(parents, i), _find(parents, j)
+        if root_i == root_j or images[root_i] & images[root_j]:
+            continue
+        parents[root_j] = root_i
+        images[root_i] |= images.pop(root_j)
+
+    roots = np.array([_find(parents, i) for i in range(offsets[-1])])
+    _, tracks = np.unique(roots, return_inverse=True)
+    return [tracks[offsets[i]:offsets[i + 1]] for i in range(len(boxes))]
+
+
+def group_targets(
+    rows: np.ndarray,
+    boxes: list[np.ndarray],
+    tracks: list[np.ndarray],
+    min_views=2,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[np.ndarray]]:
+    """
+    Collects the boxes of every track (see `associate_detections`) seen in
+    at least `min_views` images. Returns the target index, image row and
+    (2, 2) corners of every kept box, and the target index of every box
+    per image (-1 if the box was dropped).
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    counts = np.array([len(b) for b in boxes], dtype=np.intp)
+    if not counts.sum():
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros((0, 2, 2), dtype=np.float64), tracks
+    all_tracks = np.concatenate(tracks)
+    views = np.bincount(all_tracks)
+    localized = np.flatnonzero(views >= min_views)
+    target_of = np.full(len(views), -1, dtype=np.intp)
+    target_of[localized] = np.arange(len(localized))
+
+    keep = target_of[all_tracks] >= 0
+    corners = np.concatenate(boxes).reshape(-1, 2, 2)[keep].astype(np.float64)
+    return target_of[all_tracks[keep]], np.repeat(rows, counts)[keep], corners, [target_of[t] for t in tracks]
+
+
+@instrumentation.timed("localization")
+def localize_targets(
+    table: FlightTable,
+    rows: np.ndarray,
+    boxes: list[np.ndarray],
+    max_baseline=10.0,
+    max_gap=1.0,
+    min_views=2,
+    max_workers=1,
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Associates the detections of all images (see `associate_detections`)
+    and triangulates every object seen in at least `min_views` images.
+    With `max_workers` other than 1 the objects are triangulated on a
+    process pool (see `localize_jobs`, None: one process per core).
+    Returns the (top left, bottom right) ECEF corners of every object with
+    shape (T, 2, 3) and the object index of every box per image (-1 if the
+    box was not localized).
+    """
+    tracks = associate_detections(table, rows, boxes, max_baseline=max_baseline, max_gap=max_gap)
+    targets, image_rows, corners, target_of = group_targets(rows, boxes, tracks, min_views=min_views)
+    if max_workers != 1:
+        jobs = build_target_jobs(table, targets, image_rows, corners)
+        return localize_jobs(jobs, max_workers=max_workers), target_of
+    n_targets = targets.max() + 1 if len(targets) else 0
+    point_ids = (2 * targets[:, None] + np.arange(2)).reshape(-1)
+    positions = triangulate_observations(table, point_ids, np.repeat(image_rows, 2), corners.reshape(-1, 2),
+                                         n_points=2 * n_targets)
+    return positions.reshape(-1, 2, 3), target_of
@@ -1,30 +1,48 @@
-from .triangulate import triangulate
-from .metadata   import read_metadata
-from more_itertools import chunked as batched
+from .triangulate import compute_camera_matrices, undistort_points, solve_observations
+from .flight_table import FlightTable
+from .instrumentation import instrumentation
 import numpy as np
 
 image_bbox = tuple[str, any]
 
-def _triangulate_two_images(img1: image_bbox, img2: image_bbox):
-    img1_path, img1_bbox = img1
-    img2_path, img2_bbox = img2
-    print(f"Triangulating {img1_path} and {img2_path}")
-    img1_metadata, img2_metadata = read_metadata(img1_path), read_metadata(img2_path)
-    points = []
-    for p1, p2 in zip(batched(img1_bbox, n=2), batched(img2_bbox, n=2)):
-        p = triangulate(img1_metadata,
-                        img2_metadata,
-                        (int(p1[0]), int(p1[1])), (int(p2[0]), int(p2[1])))
-        points.append(p)
-    return np.array(points)
+def _bbox_corners(bbox) -> np.ndarray:
+    """
+    Returns the (x_min, y_min) and (x_max, y_max) corners of a bbox as a (2, 2) array
+    """
+    return np.asarray(bbox, dtype=np.float64).reshape(2, 2)
+
+def bbox_views(table: FlightTable, rows, bboxes: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Prepares the bbox `bboxes[k]` seen in image `rows[k]` of `table` for `solve_bbox`.
+    This is the part of the triangulation that only depends on a single image,
+    so it can run ahead while other images are still being detected.
+    Returns the projection matrices with shape (V, 3, 4) and the undistorted
+    corners with shape (V, 2, 2).
+    """
+    P, K = compute_camera_matrices(table, np.asarray(rows, dtype=np.intp))
+    corners = np.concatenate([_bbox_corners(bbox) for bbox in bboxes]) if len(bboxes) else np.zeros((0, 2))
+    return P, undistort_points(corners, K).reshape(-1, 2, 2)
+
+def solve_bbox(P: np.ndarray, pixels: np.ndarray) -> np.ndarray:
+    """
+    Triangulates both bbox corners from all views of `bbox_views` in a single
+    least-squares solve per corner. Returns the ECEF corners with shape (2, 3).
+    """
+    point_ids = np.tile([0, 1], len(P))
+    return solve_observations(np.repeat(P, 2, axis=0), pixels.reshape(-1, 2), point_ids, n_points=2)
 
-def get_bbox_positions(images: list[tuple[image_bbox, image_bbox]]):
+@instrumentation.timed("triangulation")
+def get_bbox_positions(images: list[tuple[image_bbox, image_bbox]], table: FlightTable | None = None):
     """
-    Returns the averaged, triangulated bbox positions from a list of pairs of images.
+    Returns the triangulated bbox positions from a list of pairs of images.
+    Every image that appears in any pair contributes to a single least-squares
+    solve per bbox corner, instead of triangulating and averaging each pair,
+    so only the best ranked pairs should be passed (see `TOP_K`).
+    `table` must contain all images, it is read from the images if omitted.
     """
-    bbox = []
-    for img1, img2 in images:
-        print(img1, img2)
-        bbox.append(_triangulate_two_images(img1, img2))
-    # return np.mean(bbox, axis=0)
-    return bbox[0]
+    if table is None:
+        table = FlightTable.from_paths([img[0] for pair in images for img in pair])
+    # every image only counts once, even if it is part of several pairs
+    views = dict(img for pair in images for img in pair)
+    instrumentation.trace(f"Triangulating the bbox from {len(views)} images")
+    return solve_bbox(*bbox_views(table, table.indices(list(views)), list(views.values())))
@@ -0,0 +1,119 @@
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+__all__ = [
+    "MetadataCache",
+    "metadata_cache",
+]
+
+SIDECAR_NAME = ".dji_metadata.json"
+SIDECAR_VERSION = 2
+
+Fields = dict[str, str]
+
+
+class MetadataCache:
+    """
+    Caches the parsed metadata fields of images.
+    Lookups first hit an in-memory LRU and then a sidecar index
+    (`SIDECAR_NAME`) stored next to the images. Entries are keyed by
+    path, size and mtime, so an image that is modified is read again.
+    """
+
+    def __init__(self, maxsize=8192, sidecar_name=SIDECAR_NAME, persist=True):
+        self.maxsize = maxsize
+        self.sidecar_name = sidecar_name
+        self.persist = persist
+        self._lru: OrderedDict[str, tuple[int, int, Fields]] = OrderedDict()
+        self._sidecars: dict[Path, dict[str, dict]] = {}
+        self._dirty: set[Path] = set()
+        self._lock = threading.RLock()
+
+    def get(self, file_path: str | Path, loader: Callable[[Path], Fields]) -> Fields:
+        """
+        Returns the fields of `file_path`, calling `loader` only if
+        neither the memory nor the sidecar cache hold a valid entry.
+        """
+        path = Path(os.path.abspath(file_path))
+        stat = path.stat()
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        key = str(path)
+
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+                self._lru.move_to_end(key)
+                return entry[2]
+            if self.persist:
+                stored = self._sidecar(path.parent).get(path.name)
+                if stored is not None and stored["size"] == size and stored["mtime_ns"] == mtime_ns:
+                    self._remember(key, size, mtime_ns, stored["fields"])
+                    return stored["fields"]
+
+        fields = loader(path)
+
+        with self._lock:
+            self._remember(key, size, mtime_ns, fields)
+            if self.persist:
+                self._sidecar(path.parent)[path.name] = {
+                    "size": size,
+                    "mtime_ns": mtime_ns,
+                    "fields": fields,
+                }
+                self._dirty.add(path.parent)
+        return fields
+
+    def flush(self):
+        """
+        Writes all modified sidecar indices to disk.
+        Directories that are not writable are skipped.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for directory in dirty:
+                sidecar_path = directory / self.sidecar_name
+                tmp_path = sidecar_path.with_name(sidecar_path.name + ".tmp")
+                try:
+                    with open(tmp_path, "w") as f:
+                        json.dump({"version": SIDECAR_VERSION, "entries": self._sidecars[directory]}, f)
+                    os.replace(tmp_path, sidecar_path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """
+        Drops the in-memory entries. Sidecar files are left untouched.
+        """
+        with self._lock:
+            self._lru.clear()
+            self._sidecars.clear()
+            self._dirty.clear()
+
+    def _remember(self, key: str, size: int, mtime_ns: int, fields: Fields):
+        self._lru[key] = (size, mtime_ns, fields)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _sidecar(self, directory: Path) -> dict[str, dict]:
+        if directory not in self._sidecars:
+            entries = {}
+            try:
+                with open(directory / self.sidecar_name, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == SIDECAR_VERSION:
+                    entries = data["entries"]
+            except (OSError, ValueError, KeyError):
+                pass
+            self._sidecars[directory] = entries
+        return self._sidecars[directory]
+
+
+# shared by every `read_metadata` in the project
+metadata_cache = MetadataCache()
+atexit.register(metadata_cache.flush)
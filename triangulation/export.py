@@ -1,45 +1,138 @@
 import chevron
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from zipfile import ZipFile
 import numpy as np
 
+from .instrumentation import instrumentation
+
 Waypoint = np.typing.NDArray | list[float, float, float]
 
-def write_file(waypoints: list[Waypoint], output_filename="output.kmz"):
-    waypoints = [
-        {   
-            "latitude": wp[0],
-            "longitude": wp[1],
-            "absoluteHeight": wp[2],
-            "index": i 
-        } 
-        for i, wp in enumerate(waypoints)
-    ]
-    base_path = Path.cwd() / "templates"
-    waylines_template = base_path / "waylines.wpml"
-    template_template = base_path / "template.kml"
+# archive name -> template file
+TEMPLATES = {
+    "wpmz/waylines.wpml": "waylines.wpml",
+    "wpmz/template.kml": "template.kml",
+}
+
+
+def _html_escape(text: str) -> str:
+    # same escaping as chevron
+    return text.replace("&", "&amp;").replace('"', "&quot;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _compile(tokens) -> list:
+    """
+    Turns chevron tokens into a tree of (tag, key, children) nodes.
+    Only literals, variables and sections are supported, which is all
+    the mission templates use.
+    """
+    root: list = []
+    stack = [root]
+    for tag, key in tokens:
+        if tag == "literal":
+            stack[-1].append(("literal", key, None))
+        elif tag in ("variable", "no escape"):
+            stack[-1].append((tag, key, None))
+        elif tag == "section":
+            children: list = []
+            stack[-1].append(("section", key, children))
+            stack.append(children)
+        elif tag == "end":
+            stack.pop()
+        elif tag != "comment":
+            raise ValueError(f"Unsupported template tag '{tag}'")
+    return root
+
+
+def _lookup(key: str, scopes: list):
+    for scope in scopes:
+        if isinstance(scope, dict) and key in scope:
+            return scope[key]
+    return ""
+
+
+def _render(nodes: list, scopes: list, output: list):
+    for tag, key, children in nodes:
+        if tag == "literal":
+            output.append(key)
+        elif tag == "variable":
+            output.append(_html_escape(str(_lookup(key, scopes))))
+        elif tag == "no escape":
+            output.append(str(_lookup(key, scopes)))
+        else:
+            value = _lookup(key, scopes)
+            if isinstance(value, (list, tuple)):
+                for item in value:
+                    _render(children, [item] + scopes, output)
+            elif value:
+                _render(children, [value] + scopes, output)
+
+
+@lru_cache(maxsize=None)
+def _load_template(template_path: str) -> list:
+    """
+    Reads and compiles a template once per process
+    """
+    with open(template_path, "r") as tmpl:
+        return _compile(chevron.tokenizer.tokenize(tmpl.read()))
+
+
+def render_template(template_path: str | Path, context: dict) -> str:
+    """
+    Renders a (cached) mustache template
+    """
+    output: list = []
+    _render(_load_template(str(template_path)), [context], output)
+    return "".join(output)
+
+
+def _template_context(waypoints: list[Waypoint]) -> dict:
+    return {
+        "waypoints": [
+            {
+                "latitude": wp[0],
+                "longitude": wp[1],
+                "absoluteHeight": wp[2],
+                "index": i
+            }
+            for i, wp in enumerate(waypoints)
+        ]
+    }
+
+
+@instrumentation.timed("export")
+def write_file(waypoints: list[Waypoint], output_filename="output.kmz", template_dir: str | Path | None = None):
+    """
+    Writes the waypoints as a DJI mission (KMZ) to ``output_filename``.
+    The templates are rendered straight into the archive entries.
+    """
+    base_path = Path(template_dir) if template_dir is not None else Path.cwd() / "templates"
+    context = _template_context(waypoints)
     with ZipFile(output_filename, "w") as zfile:
-        # write the waylines file
-        with tempfile.NamedTemporaryFile("w+") as waylines:
-            with open(waylines_template, "r") as tmpl:
-                waylines.write(chevron.render(tmpl, {
-                    "waypoints": waypoints,
-                }))
-            zfile.write(waylines.name, arcname="wpmz/waylines.wpml")
-        # write the template file
-        with tempfile.NamedTemporaryFile("w+") as template_file:
-            with open(template_template, "r") as tmpl:
-                template_file.write(chevron.render(tmpl, {
-                    "waypoints": waypoints
-                }))
-            zfile.write(template_file.name, arcname="wpmz/template.kml")
+        for arcname, template_name in TEMPLATES.items():
+            with zfile.open(arcname, "w") as entry:
+                entry.write(render_template(base_path / template_name, context).encode("utf-8"))
+
+
+def write_files(missions: dict[str | Path, list[Waypoint]], template_dir: str | Path | None = None, max_workers=None):
+    """
+    Writes many missions at once, ``missions`` maps the output filename to its waypoints.
+    The archives are written on a thread pool.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(write_file, waypoints, output_filename, template_dir)
+            for output_filename, waypoints in missions.items()
+        ]
+        for future in futures:
+            future.result()
 
 
 # for testing
 if __name__ == "__main__":
     waypoints = [
-        Waypoint(latitude=47.234, longitude=12.234, absolute_height=450.32),
-        Waypoint(latitude=-43.23, longitude=-40.032, absolute_height=304.21),
+        [47.234, 12.234, 450.32],
+        [-43.23, -40.032, 304.21],
     ]
-    write_file(waypoints)
\ No newline at end of file
+    write_file(waypoints)
@@ -1,8 +1,9 @@
 import numpy as np
 
 from dataclasses import dataclass
-from pyproj import Transformer
 from .export import write_file
+from .geodesy import wgs84_to_ecef, ecef_to_wgs84
+from .instrumentation import instrumentation
 
 Point = np.typing.NDArray
 
@@ -12,6 +13,7 @@ class Position:
     longitude: float
     altitude: float
 
+@instrumentation.timed("flight_planning")
 def generate_flight_plan(
     top_left: Point,
     bottom_right: Point,
@@ -46,15 +48,12 @@ def generate_flight_plan(
     ]
     plane_points_ecef = np.array(plane_points_ecef)
 
-    wgs84_to_ecef = Transformer.from_crs("EPSG:4326", "EPSG:4978", always_xy=True)
-    ecef_to_wgs84 = Transformer.from_crs("EPSG:4978", "EPSG:4326", always_xy=True)
-
     v1 = plane_points_ecef[1] - plane_points_ecef[0]
     v2 = plane_points_ecef[2] - plane_points_ecef[0]
     normal = np.cross(v1, v2)
     normal /= np.linalg.norm(normal)
 
-    drone_ecef = np.array(wgs84_to_ecef.transform(drone_position.longitude, drone_position.latitude, drone_position.altitude))
+    drone_ecef = wgs84_to_ecef(drone_position.latitude, drone_position.longitude, drone_position.altitude)
 
 
     inverted_normal = -normal
@@ -69,12 +68,7 @@ def generate_flight_plan(
     displaced_ecef_points = plane_points_ecef + d * normal
 
     # Convert displaced points back to lat/lon/alt
-    displaced_points = []
-    for x, y, z in displaced_ecef_points:
-        lon, lat, alt = ecef_to_wgs84.transform(x, y, z)
-        displaced_points.append([lat, lon, alt])
-
-    displaced_points = np.array(displaced_points)
+    displaced_points = ecef_to_wgs84(displaced_ecef_points)
     current_altitude = box_max_height
     min_altitude = box_min_height
     start_lat, start_long = [float(x) for x in displaced_points[0][:2]]
@@ -92,3 +86,122 @@ def generate_flight_plan(
         start_lat, start_long, end_lat, end_long = end_lat, end_long, start_lat, start_long
 
     return flight_path
+
+
+def generate_facade_sweeps(
+    top_left: np.ndarray,
+    bottom_right: np.ndarray,
+    drone_position: Position,
+    plane_distance=3.0,
+    descend=1.5,
+    box_max_height=4.0,
+    box_min_height=1.0,
+) -> np.ndarray:
+    """
+    Vectorized `generate_flight_plan` for many targets at once.
+    `top_left` and `bottom_right` are ECEF corners with shape (T, 3).
+    Returns the S-shaped sweep of every target as an array with shape
+    (T, waypoints, 3) of latitude, longitude and altitude.
+    """
+    top_left = np.asarray(top_left, dtype=np.float64).reshape(-1, 3)
+    bottom_right = np.asarray(bottom_right, dtype=np.float64).reshape(-1, 3)
+    x1, y1, z1 = top_left.T
+    x2, y2, z2 = bottom_right.T
+
+    # Top-left, Top-right and Bottom-left plane points (in ECEF), see `generate_flight_plan`
+    v1 = np.column_stack((x2, y1, z1)) - top_left
+    v2 = np.column_stack((x1, y2, z2)) - top_left
+    normal = np.cross(v1, v2)
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+
+    drone_ecef = wgs84_to_ecef(drone_position.latitude, drone_position.longitude, drone_position.altitude)
+    # check which direction the normal vectors should face
+    flip = np.linalg.norm(-normal - drone_ecef, axis=1) < np.linalg.norm(normal - drone_ecef, axis=1)
+    normal[flip] *= -1
+
+    # displaced top-left and bottom-right corners, converted in one call
+    displaced = ecef_to_wgs84(np.stack((top_left, bottom_right), axis=1) + plane_distance * normal[:, None])
+    start, end = displaced[:, 0, :2], displaced[:, 1, :2]
+
+    rows = max(int(np.ceil((box_max_height - box_min_height) / descend)), 0)
+    altitudes = box_max_height - descend * np.arange(rows)
+    # fly from left to right, then back
+    reverse = (np.arange(rows) % 2 == 1)[None, :, None]
+    first = np.where(reverse, end[:, None], start[:, None])
+    second = np.where(reverse, start[:, None], end[:, None])
+    sweeps = np.empty((len(top_left), rows, 2, 3))
+    sweeps[:, :, 0, :2] = first
+    sweeps[:, :, 1, :2] = second
+    sweeps[:, :, :, 2] = altitudes[None, :, None]
+    return sweeps.reshape(len(top_left), 2 * rows, 3)
+
+
+def _route_length(route: np.ndarray, distances: np.ndarray) -> float:
+    return distances[route[:-1], route[1:]].sum()
+
+
+def order_targets(points: np.ndarray, start: np.ndarray) -> np.ndarray:
+    """
+    Orders the targets `points` (T, 2 or 3) into a short open route from `start`.
+    A nearest-neighbour route is improved with 2-opt moves until no move shortens it.
+    Returns the visiting order as indices into `points`.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 2:
+        return np.arange(len(points))
+    # node 0 is the start
+    nodes = np.vstack((np.asarray(start, dtype=np.float64)[None], points))
+    distances = np.linalg.norm(nodes[:, None] - nodes[None], axis=-1)
+
+    route = [0]
+    unvisited = np.ones(len(nodes), dtype=bool)
+    unvisited[0] = False
+    for _ in range(len(points)):
+        candidates = np.where(unvisited, distances[route[-1]], np.inf)
+        route.append(int(candidates.argmin()))
+        unvisited[route[-1]] = False
+    route = np.array(route)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(route) - 1):
+            # reverse route[i:j + 1] for all j at once
+            j = np.arange(i + 1, len(route))
+            a, b, c = route[i - 1], route[i], route[j]
+            after = np.append(route[j[:-1] + 1], -1)
+            gain = distances[a, b] - distances[a, c]
+            has_next = after >= 0
+            gain[has_next] += distances[c[has_next], after[has_next]] - distances[b, after[has_next]]
+            best = gain.argmax()
+            if gain[best] > 1e-9:
+                route[i:j[best] + 1] = route[i:j[best] + 1][::-1]
+                improved = True
+    return route[1:] - 1
+
+
+@instrumentation.timed("flight_planning")
+def plan_mission(
+    targets: np.ndarray,
+    drone_position: Position,
+    plane_distance=3.0,
+    descend=1.5,
+    box_max_height=4.0,
+    box_min_height=1.0,
+) -> list[list[float]]:
+    """
+    Plans one mission covering many targets.
+    `targets` holds the ECEF (top left, bottom right) corners with shape (T, 2, 3).
+    Every target gets a facade sweep like in `generate_flight_plan`, the targets
+    are visited in a short order starting from `drone_position`.
+    Returns the waypoints of the whole mission.
+    """
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2, 3)
+    if not len(targets):
+        return []
+    sweeps = generate_facade_sweeps(targets[:, 0], targets[:, 1], drone_position,
+                                    plane_distance=plane_distance, descend=descend,
+                                    box_max_height=box_max_height, box_min_height=box_min_height)
+    start = wgs84_to_ecef(drone_position.latitude, drone_position.longitude, drone_position.altitude)
+    order = order_targets(targets.mean(axis=1), start)
+    return sweeps[order].reshape(-1, 3).tolist()
@@ -0,0 +1,108 @@
+import numpy as np
+
+from pathlib import Path
+from .metadata import DJIMetadata, read_metadata_many
+from .geodesy import wgs84_to_ecef
+from .instrumentation import instrumentation
+
+__all__ = [
+    "FlightTable",
+    "FLIGHT_DTYPE",
+]
+
+# one row per image, ~170 bytes each
+FLIGHT_DTYPE = np.dtype([
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("relative_altitude", np.float64),
+    ("absolute_altitude", np.float64),
+    ("yaw", np.float64),
+    ("pitch", np.float64),
+    ("roll", np.float64),
+    ("focal_length", np.float64),
+    ("image_width", np.int32),
+    ("image_height", np.int32),
+    ("ecef", np.float64, (3,)),
+    ("rotation", np.float64, (3, 3)),
+])
+
+METADATA_COLUMNS = (
+    "latitude", "longitude", "relative_altitude", "absolute_altitude",
+    "yaw", "pitch", "roll", "focal_length", "image_width", "image_height",
+)
+
+
+class FlightTable:
+    """
+    Columnar metadata of all images of a flight.
+    `rows` is a structured array with `FLIGHT_DTYPE`, row `i` belongs to `paths[i]`.
+    The camera position (ECEF) and the gimbal rotation matrix are precomputed,
+    so downstream code can work on whole columns at once.
+    """
+
+    def __init__(self, paths: list[str], rows: np.ndarray):
+        self.paths = paths
+        self.rows = rows
+        self._index = {path: i for i, path in enumerate(paths)}
+
+    @classmethod
+    @instrumentation.timed("metadata")
+    def from_paths(cls, file_paths: list[str | Path], max_workers=None) -> "FlightTable":
+        """
+        Reads the metadata of all `file_paths` (in parallel) into a table.
+        Duplicate paths are only stored once.
+        """
+        paths = list(dict.fromkeys(str(p) for p in file_paths))
+        return cls.from_metadata(paths, read_metadata_many(paths, max_workers=max_workers))
+
+    @classmethod
+    def from_metadata(cls, paths: list[str], metadata: list[DJIMetadata]) -> "FlightTable":
+        rows = np.zeros(len(paths), dtype=FLIGHT_DTYPE)
+        for column in METADATA_COLUMNS:
+            rows[column] = [getattr(m, column) for m in metadata]
+        if len(rows):
+            from scipy.spatial.transform import Rotation as R
+
+            rows["ecef"] = wgs84_to_ecef(rows["latitude"], rows["longitude"], rows["absolute_altitude"])
+            angles = np.column_stack((rows["yaw"], rows["pitch"], rows["roll"]))
+            rows["rotation"] = R.from_euler('zyx', angles, degrees=True).as_matrix()
+        return cls(paths, rows)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path: str | Path):
+        return str(path) in self._index
+
+    def index(self, path: str | Path) -> int:
+        """
+        Returns the row of `path`
+        """
+        return self._index[str(path)]
+
+    def indices(self, paths: list[str | Path]) -> np.ndarray:
+        """
+        Returns the rows of all `paths`
+        """
+        return np.array([self._index[str(p)] for p in paths], dtype=np.intp)
+
+    @property
+    def ecef(self) -> np.ndarray:
+        return self.rows["ecef"]
+
+    @property
+    def rotation(self) -> np.ndarray:
+        return self.rows["rotation"]
+
+    def distances(self, rows1: np.ndarray, rows2: np.ndarray) -> np.ndarray:
+        """
+        Returns the camera distances between `rows1[k]` and `rows2[k]` in meters
+        """
+        return np.linalg.norm(self.ecef[rows1] - self.ecef[rows2], axis=-1)
+
+    def metadata(self, i: int) -> DJIMetadata:
+        """
+        Returns row `i` as a `DJIMetadata` object
+        """
+        row = self.rows[i]
+        return DJIMetadata(**{column: row[column].item() for column in METADATA_COLUMNS})
@@ -0,0 +1,84 @@
+import numpy as np
+
+from functools import lru_cache
+from pyproj import Transformer
+
+__all__ = [
+    "transformer",
+    "wgs84_to_ecef",
+    "ecef_to_wgs84",
+    "enu_basis",
+    "ecef_to_enu",
+    "enu_to_ecef",
+]
+
+WGS84 = "EPSG:4326"
+ECEF = "EPSG:4978"
+
+
+@lru_cache(maxsize=None)
+def transformer(source: str, target: str) -> Transformer:
+    """
+    Returns a process-wide cached transformer from `source` to `target`.
+    Coordinates are always in (longitude, latitude) order.
+    """
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def wgs84_to_ecef(latitude, longitude, altitude) -> np.ndarray:
+    """
+    Converts WGS84 coordinates (scalars or broadcastable arrays) to ECEF.
+    Returns an array with shape (..., 3).
+    """
+    longitude, latitude, altitude = np.broadcast_arrays(
+        np.asarray(longitude, dtype=np.float64),
+        np.asarray(latitude, dtype=np.float64),
+        np.asarray(altitude, dtype=np.float64),
+    )
+    x, y, z = transformer(WGS84, ECEF).transform(longitude, latitude, altitude)
+    return np.stack((x, y, z), axis=-1)
+
+
+def ecef_to_wgs84(points) -> np.ndarray:
+    """
+    Converts ECEF points with shape (..., 3) to WGS84.
+    Returns an array with shape (..., 3) of latitude, longitude and altitude.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    longitude, latitude, altitude = transformer(ECEF, WGS84).transform(
+        points[..., 0], points[..., 1], points[..., 2]
+    )
+    return np.stack((latitude, longitude, altitude), axis=-1)
+
+
+def enu_basis(latitude: float, longitude: float) -> np.ndarray:
+    """
+    Returns the rotation from ECEF to the local east/north/up frame
+    at the given position as a (3, 3) matrix (rows: east, north, up).
+    """
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    return np.array([
+        [-sin_lon, cos_lon, 0.0],
+        [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+        [cos_lat * cos_lon, cos_lat * sin_lon, sin_lat],
+    ])
+
+
+def ecef_to_enu(points, origin) -> np.ndarray:
+    """
+    Converts ECEF points with shape (..., 3) into a local east/north/up
+    frame centered at `origin` (latitude, longitude, altitude).
+    """
+    origin_ecef = wgs84_to_ecef(*origin)
+    return (np.asarray(points, dtype=np.float64) - origin_ecef) @ enu_basis(origin[0], origin[1]).T
+
+
+def enu_to_ecef(points, origin) -> np.ndarray:
+    """
+    Converts local east/north/up points with shape (..., 3)
+    around `origin` (latitude, longitude, altitude) back to ECEF.
+    """
+    origin_ecef = wgs84_to_ecef(*origin)
+    return np.asarray(points, dtype=np.float64) @ enu_basis(origin[0], origin[1]) + origin_ecef
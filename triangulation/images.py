@@ -0,0 +1,10 @@
+__all__ = [
+    "IMAGE_SUFFIXES",
+    "REDUCED_FLAGS",
+]
+
+# lower case suffixes of the image files that are read
+IMAGE_SUFFIXES = {".bmp", ".dng", ".jpeg", ".jpg", ".mpo", ".png", ".tif", ".tiff", ".webp"}
+
+# OpenCV flags that let libjpeg decode at 1/2, 1/4 or 1/8 of the size, by downscale factor
+REDUCED_FLAGS = {2: "IMREAD_REDUCED_COLOR_2", 4: "IMREAD_REDUCED_COLOR_4", 8: "IMREAD_REDUCED_COLOR_8"}
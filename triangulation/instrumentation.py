@@ -0,0 +1,139 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+__all__ = [
+    "Instrumentation",
+    "instrumentation",
+]
+
+# opt-in switches for runs that are not started from code, e.g. the notebook
+VERBOSE_ENV = "TRIANGULATION_VERBOSE"
+REPORT_ENV = "TRIANGULATION_REPORT"
+
+
+class Instrumentation:
+    """
+    Collects wall-clock timings per pipeline stage and event counters.
+    Stages nest: a stage entered while another one is running is reported
+    as "outer/inner", so the report shows where the time of each stage goes.
+    Debug output goes through `trace` and is only printed when `verbose` is set.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages: dict[str, list[float]] = {}
+        self._counters: dict[str, int] = {}
+        self._started = time.time()
+
+    def _stack(self) -> list[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the enclosed block as stage `name`
+        """
+        stack = self._stack()
+        stack.append(name)
+        key = "/".join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                entry = self._stages.setdefault(key, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+    def timed(self, name: str):
+        """
+        Decorator that times every call of a function as stage `name`
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, n=1):
+        """
+        Adds `n` to the counter `name`
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + int(n)
+
+    def trace(self, *args):
+        """
+        Prints `args` if verbose tracing is enabled
+        """
+        if self.verbose:
+            print(*args)
+
+    @contextmanager
+    def profile(self, output_path: str | Path | None = None):
+        """
+        Runs the enclosed block under cProfile and writes the stats to `output_path`
+        (readable with `pstats` or snakeviz). Yields the profiler.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            if output_path is not None:
+                profiler.dump_stats(str(output_path))
+
+    def report(self) -> dict:
+        """
+        Returns the timings and counters collected so far
+        """
+        with self._lock:
+            return {
+                "started": self._started,
+                "wall_time": time.time() - self._started,
+                "stages": {
+                    key: {"calls": calls, "total": total, "max": longest}
+                    for key, (calls, total, longest) in sorted(self._stages.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def write_report(self, output_path: str | Path):
+        """
+        Writes `report` as JSON to `output_path`
+        """
+        with open(output_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def reset(self):
+        """
+        Drops all timings and counters, e.g. between two runs in one process
+        """
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._started = time.time()
+
+
+# shared by all stages of the pipeline
+instrumentation = Instrumentation(verbose=bool(os.environ.get(VERBOSE_ENV)))
+
+if os.environ.get(REPORT_ENV):
+    atexit.register(instrumentation.write_report, os.environ[REPORT_ENV])
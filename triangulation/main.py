@@ -1,21 +1,88 @@
 from .bbox            import get_bbox_positions, image_bbox
-from .flight_planning import generate_flight_plan, Position
-from .metadata        import read_metadata
+from .flight_planning import generate_flight_plan, plan_mission, Position
+from .flight_table    import FlightTable
 from .export          import write_file
+from .association     import localize_targets
+from .store           import ResultStore
+from pathlib          import Path
+import numpy as np
 
 
-def write_flight_plan(image_pairs: list[tuple[image_bbox, image_bbox]], output_file="output.kmz", plane_distance=2.0, descend=1.5):
+def _flight_name(image_path: str) -> str:
+    # images of one flight are stored in one folder
+    return Path(image_path).parent.name
+
+
+def write_flight_plan(image_pairs: list[tuple[image_bbox, image_bbox]], output_file="output.kmz", plane_distance=2.0, descend=1.5,
+                      store: ResultStore | None = None, flight: str | None = None, table: FlightTable | None = None,
+                      detections: list | None = None, bbox_positions: np.ndarray | None = None):
     """
     Writes a flight plan from the image paris to ``output_file``.
     The drone will pass ``plane_distance``m (default=3) in front of the bbox
     and descend ``descend``m (default=1.5) after each row.
+    If a ``store`` is given, the pairs, detections, position and waypoints are appended
+    to it under ``flight`` (default: the folder of the first image). The detections are
+    the ``Detection`` records of all images of the run if given, otherwise only the
+    merged bboxes of the paired images are known.
+    A ``table`` that already holds the metadata of all images may be passed in,
+    as well as the ``bbox_positions`` if the pairs were already triangulated.
+    Raises a ValueError if the pairs are degenerate and give no finite plan.
     """
-    bbox_positions = get_bbox_positions(image_pairs)
+    if table is None:
+        table = FlightTable.from_paths([img[0] for pair in image_pairs for img in pair])
+    if bbox_positions is None:
+        bbox_positions = get_bbox_positions(image_pairs, table)
     # required for the flight plan
-    metadata = read_metadata(image_pairs[0][0][0])
-    drone_position = Position(metadata.latitude, metadata.longitude, metadata.absolute_altitude)
+    drone = table.rows[table.index(image_pairs[0][0][0])]
+    drone_position = Position(float(drone["latitude"]), float(drone["longitude"]), float(drone["absolute_altitude"]))
     flight_plan = generate_flight_plan(bbox_positions[0], bbox_positions[1], drone_position, plane_distance=plane_distance, descend=descend)
+    # e.g. both images of a pair taken from the same spot
+    if not np.isfinite(np.asarray(flight_plan, dtype=np.float64)).all():
+        raise ValueError(f"The pairs of {image_pairs[0][0][0]} do not span a bbox, no flight plan was written")
+    write_file(flight_plan, output_file)
+    if store is not None:
+        if detections is not None:
+            images = [detection.path for detection in detections]
+            boxes = [np.column_stack((d.xyxy, d.conf, d.cls)) for d in detections]
+        else:
+            # every image once, even if it is part of several pairs
+            views = dict(img for pair in image_pairs for img in pair)
+            images, boxes = list(views), [[bbox] for bbox in views.values()]
+        store.append(
+            flight or _flight_name(image_pairs[0][0][0]),
+            images=images,
+            detections=boxes,
+            pairs=[(img1[0], img2[0]) for img1, img2 in image_pairs],
+            points=bbox_positions[None],
+            waypoints=flight_plan,
+        )
+
+
+def write_targets_flight_plan(image_paths: list[str], boxes: list, output_file="output.kmz", plane_distance=2.0, descend=1.5, max_workers=1,
+                              store: ResultStore | None = None, flight: str | None = None, max_distance=10.0, max_gap=1.0):
+    """
+    Writes one flight plan covering every object found in the images to ``output_file``.
+    ``boxes[i]`` holds the (n, 4) xyxy detections of ``image_paths[i]``.
+    Detections are matched across images whose cameras are at most ``max_distance``m
+    apart by the ``max_gap``m between their bearing rays, localized with ``localize_targets``
+    in this process (or on a pool of ``max_workers`` processes, None: one per core) and
+    planned with ``plan_mission``, starting at the first image. The solve is a single batched
+    SVD, so the pool only pays off for very many objects.
+    If a ``store`` is given, the detections, positions and waypoints are appended to it.
+    Returns the positions and the object index of every box (-1: not localized),
+    like ``localize_targets``.
+    """
+    table = FlightTable.from_paths(image_paths)
+    positions, target_of = localize_targets(table, table.indices(image_paths), boxes, max_baseline=max_distance,
+                                    max_gap=max_gap, max_workers=max_workers)
+    drone = table.rows[table.index(image_paths[0])]
+    drone_position = Position(float(drone["latitude"]), float(drone["longitude"]), float(drone["absolute_altitude"]))
+    flight_plan = plan_mission(positions, drone_position, plane_distance=plane_distance, descend=descend)
     write_file(flight_plan, output_file)
+    if store is not None:
+        store.append(flight or _flight_name(image_paths[0]), images=image_paths, detections=boxes,
+                     points=positions, waypoints=flight_plan)
+    return positions, target_of
 
 
 '''if __name__ == "__main__":
@@ -1,9 +1,20 @@
-from libxmp.utils import file_to_dict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from fractions import Fraction
 from pathlib import Path
+from .cache import metadata_cache
+from .instrumentation import instrumentation
+from .xmp import read_xmp_fields
+
+try:
+    from libxmp.utils import file_to_dict
+except Exception:  # libxmp raises ExempiLoadError if exempi itself is missing
+    file_to_dict = None
 
 __all__ = [
-    "read_metadata"
+    "read_metadata",
+    "read_metadata_many",
+    "read_fields",
 ]
 
 @dataclass
@@ -37,6 +48,9 @@ FOCAL_LENGTH = f"{EXIF_PREFIX}FocalLength"
 IMAGE_WIDTH = f"{EXIF_PREFIX}PixelXDimension"
 IMAGE_HEIGHT = f"{EXIF_PREFIX}PixelYDimension"
 
+DJI_FIELDS = (RELATIVE_ALTITUDE, ABSOLUTE_ALTITUDE, YAW, PITCH, ROLL, LATITUDE, LONGITUDE)
+EXIF_FIELDS = (FOCAL_LENGTH, IMAGE_WIDTH, IMAGE_HEIGHT)
+
 
 def _metadata_to_dict(metadata: list[tuple]) -> dict[str, str]:
     """
@@ -46,14 +60,12 @@ def _metadata_to_dict(metadata: list[tuple]) -> dict[str, str]:
         entry[0] : entry[1] for entry in metadata
     }
 
-def read_metadata(file_path: str | Path) -> DJIMetadata:
+def _read_exempi_fields(file_path: str | Path) -> dict[str, str]:
     """
-    Reads the relevant metadata from `file`
+    Reads the DJI and EXIF fields from the XMP data of `file` using exempi
     """
-    print(f"Reading metadata from {file_path}")
+    instrumentation.count("exempi_calls")
     xmp_data = file_to_dict(str(file_path))
-    print(f"XMP data: {xmp_data}")
-    print(f"Reading metadata from {file_path}")
     # two different keys may be used to identify the data
     if DJI_KEY in xmp_data:
         dji_metadata = _metadata_to_dict(xmp_data[DJI_KEY])
@@ -61,15 +73,59 @@ def read_metadata(file_path: str | Path) -> DJIMetadata:
         dji_metadata = _metadata_to_dict(xmp_data[DJI_KEY_ALTERNATIVE])
     exif_metadata = _metadata_to_dict(xmp_data[EXIF_KEY])
 
+    fields = {key: dji_metadata[key] for key in DJI_FIELDS if key in dji_metadata}
+    fields.update({key: exif_metadata[key] for key in EXIF_FIELDS if key in exif_metadata})
+    return fields
+
+def _read_xmp_fields(file_path: str | Path) -> dict[str, str]:
+    """
+    Reads the DJI fields from the XMP packet and the EXIF fields from the
+    EXIF block of `file`, as exempi merges them.
+    Falls back to exempi (if installed) when fields are missing.
+    Raises a KeyError naming the fields that are still missing, so an
+    incomplete read is never cached.
+    """
+    instrumentation.count("metadata_reads")
+    xmp_fields = read_xmp_fields(file_path)
+    fields = {key: xmp_fields[key] for key in DJI_FIELDS + EXIF_FIELDS if key in xmp_fields}
+    if len(fields) < len(DJI_FIELDS) + len(EXIF_FIELDS) and file_to_dict is not None:
+        fields = _read_exempi_fields(file_path)
+    missing = [key for key in DJI_FIELDS + EXIF_FIELDS if key not in fields]
+    if missing:
+        raise KeyError(f"{file_path} has no {', '.join(missing)}")
+    return fields
+
+def read_fields(file_path: str | Path) -> dict[str, str]:
+    """
+    Returns the raw metadata fields of `file`.
+    Results are cached in memory and in a sidecar file next to the image,
+    so every image is only parsed once.
+    """
+    return metadata_cache.get(file_path, _read_xmp_fields)
+
+def read_metadata(file_path: str | Path) -> DJIMetadata:
+    """
+    Reads the relevant metadata from `file`
+    """
+    fields = read_fields(file_path)
     return DJIMetadata(
-        relative_altitude=float(dji_metadata[RELATIVE_ALTITUDE]),
-        absolute_altitude=float(dji_metadata[ABSOLUTE_ALTITUDE]),
-        yaw=float(dji_metadata[YAW]),
-        pitch=float(dji_metadata[PITCH]),
-        roll=float(dji_metadata[ROLL]),
-        latitude=float(dji_metadata[LATITUDE]),
-        longitude=float(dji_metadata[LONGITUDE]),
-        focal_length=float(eval(exif_metadata[FOCAL_LENGTH])),
-        image_width=int(exif_metadata[IMAGE_WIDTH]),
-        image_height=int(exif_metadata[IMAGE_HEIGHT])
+        relative_altitude=float(fields[RELATIVE_ALTITUDE]),
+        absolute_altitude=float(fields[ABSOLUTE_ALTITUDE]),
+        yaw=float(fields[YAW]),
+        pitch=float(fields[PITCH]),
+        roll=float(fields[ROLL]),
+        latitude=float(fields[LATITUDE]),
+        longitude=float(fields[LONGITUDE]),
+        # e.g. "6720/1000", the text comes from the image, never evaluate it
+        focal_length=float(Fraction(fields[FOCAL_LENGTH])),
+        image_width=int(fields[IMAGE_WIDTH]),
+        image_height=int(fields[IMAGE_HEIGHT])
     )
+
+def read_metadata_many(file_paths: list[str | Path], max_workers=None) -> list[DJIMetadata]:
+    """
+    Reads the metadata of many files in parallel.
+    The results are in the same order as `file_paths`.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_metadata, file_paths))
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from .flight_table import FlightTable
+from .instrumentation import instrumentation
+from .triangulate import compute_camera_matrices, undistort_points, solve_observations
+
+__all__ = [
+    "TargetJob",
+    "build_target_jobs",
+    "localize_jobs",
+]
+
+
+@dataclass
+class TargetJob:
+    """
+    Everything a worker needs to localize one target,
+    as compact arrays only.
+    """
+    index: int
+    projections: np.ndarray  # (V, 3, 4) projection matrices of the observing images
+    corners: np.ndarray      # (V, 2, 2) undistorted bbox corners in pixels
+
+
+def build_target_jobs(
+    table: FlightTable,
+    targets: np.ndarray,
+    image_rows: np.ndarray,
+    corners: np.ndarray,
+) -> list[TargetJob]:
+    """
+    Creates one job per target from the grouped boxes of `group_targets`:
+    box `k` belongs to target `targets[k]`, was seen in image `image_rows[k]`
+    of `table` and has the (2, 2) `corners[k]`.
+    """
+    if not len(targets):
+        return []
+    P, K = compute_camera_matrices(table, image_rows)
+    pixels = undistort_points(np.asarray(corners, dtype=np.float64).reshape(-1, 2), K).reshape(-1, 2, 2)
+    jobs = []
+    for target in range(targets.max() + 1):
+        members = np.flatnonzero(targets == target)
+        jobs.append(TargetJob(index=target, projections=P[members], corners=pixels[members]))
+    return jobs
+
+
+def _localize_chunk(jobs: list[TargetJob]) -> tuple[list[int], np.ndarray]:
+    """
+    Triangulates both bbox corners of all targets of a chunk in one solve
+    """
+    views = np.array([len(job.projections) for job in jobs])
+    # points 2t and 2t + 1 are the corners of target t of the chunk
+    point_ids = (2 * np.repeat(np.arange(len(jobs)), views)[:, None] + np.arange(2)).reshape(-1)
+    P = np.repeat(np.concatenate([job.projections for job in jobs]), 2, axis=0)
+    pixels = np.concatenate([job.corners for job in jobs]).reshape(-1, 2)
+    corners = solve_observations(P, pixels, point_ids, n_points=2 * len(jobs))
+    return [job.index for job in jobs], corners.reshape(-1, 2, 3)
+
+
+@instrumentation.timed("localization")
+def localize_jobs(jobs: list[TargetJob], max_workers=None) -> np.ndarray:
+    """
+    Localizes all targets on a process pool.
+    Jobs are sharded into one chunk per worker and the results are merged
+    in job order, so the output does not depend on the scheduling.
+    Returns the target corners with shape (T, 2, 3).
+    """
+    if not jobs:
+        return np.zeros((0, 2, 3))
+    if max_workers == 1 or len(jobs) == 1:
+        results = [_localize_chunk(jobs)]
+    else:
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        shards = np.array_split(np.arange(len(jobs)), workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_localize_chunk, [[jobs[i] for i in shard] for shard in shards]))
+    positions = np.empty((len(jobs), 2, 3))
+    for indices, corners in results:
+        positions[indices] = corners
+    return positions
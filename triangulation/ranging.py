@@ -0,0 +1,179 @@
+import argparse
+import csv
+import logging
+import numpy as np
+
+from pathlib import Path
+from .flight_table import FlightTable
+from .images import IMAGE_SUFFIXES, REDUCED_FLAGS
+from .instrumentation import instrumentation
+from .trigonometry import calculate_distances_to_objects, VERTICAL_FOV_DEG
+
+__all__ = [
+    "read_yolo_annotations",
+    "read_csv_annotations",
+    "estimate_ranges",
+    "write_ranges",
+]
+
+logger = logging.getLogger(__name__)
+
+# which point of a labelled box is used as the object pixel
+ANCHORS = ("center", "top", "bottom")
+
+Annotation = tuple[str, float, float]
+
+
+def _find_image(image_dir: Path, stem: str) -> Path | None:
+    for suffix in sorted(IMAGE_SUFFIXES):
+        for candidate in (suffix, suffix.upper()):
+            path = image_dir / f"{stem}{candidate}"
+            if path.exists():
+                return path
+    return None
+
+
+def read_yolo_annotations(image_dir: str | Path, label_dir: str | Path, anchor="center") -> list[Annotation]:
+    """
+    Reads YOLO label files (`class cx cy w h`, normalized) from `label_dir`.
+    Every label file belongs to the image with the same name in `image_dir`.
+    The image size is taken from the metadata, the images are not decoded.
+    Returns one (image path, x, y) annotation per box, `anchor` selects
+    the point of the box.
+    """
+    if anchor not in ANCHORS:
+        raise ValueError(f"Unknown anchor '{anchor}', expected one of {ANCHORS}")
+    image_dir, label_dir = Path(image_dir), Path(label_dir)
+    labels = []
+    for label_path in sorted(label_dir.glob("*.txt")):
+        image_path = _find_image(image_dir, label_path.stem)
+        if image_path is None:
+            instrumentation.count("labels_skipped")
+            logger.warning("No image found for %s", label_path)
+            continue
+        boxes = np.loadtxt(label_path, ndmin=2)
+        if boxes.size:
+            labels.append((str(image_path), boxes[:, 1:5]))
+    if not labels:
+        return []
+
+    table = FlightTable.from_paths([path for path, _ in labels])
+    annotations = []
+    offsets = {"center": 0.0, "top": -0.5, "bottom": 0.5}
+    for path, boxes in labels:
+        row = table.rows[table.index(path)]
+        x = boxes[:, 0] * row["image_width"]
+        y = (boxes[:, 1] + offsets[anchor] * boxes[:, 3]) * row["image_height"]
+        annotations.extend((path, float(px), float(py)) for px, py in zip(x, y))
+    return annotations
+
+
+def read_csv_annotations(csv_path: str | Path) -> list[Annotation]:
+    """
+    Reads pixel annotations from a CSV file with the columns `image`, `x` and `y`.
+    Relative image paths are resolved against the directory of the CSV file.
+    """
+    csv_path = Path(csv_path)
+    annotations = []
+    with open(csv_path, newline="") as f:
+        for entry in csv.DictReader(f):
+            image_path = Path(entry["image"])
+            if not image_path.is_absolute():
+                image_path = csv_path.parent / image_path
+            annotations.append((str(image_path), float(entry["x"]), float(entry["y"])))
+    return annotations
+
+
+def estimate_ranges(
+    annotations: list[Annotation],
+    vertical_fov_deg=VERTICAL_FOV_DEG,
+    MAXIMUM_OBJECT_HEIGHT=2.6,
+    preview_dir: str | Path | None = None,
+    preview_scale=4,
+) -> list[dict]:
+    """
+    Computes the minimum and maximum distance to every annotated pixel,
+    like `select_pixel_and_calculate_distance` but without any window.
+    Only the metadata of the images is read. If `preview_dir` is given,
+    an overlay of the annotations is written for every image, decoded at
+    1/`preview_scale` of its resolution.
+    """
+    if not annotations:
+        return []
+    paths = [path for path, _, _ in annotations]
+    table = FlightTable.from_paths(paths)
+    image = table.rows[table.indices(paths)]
+    y = np.array([py for _, _, py in annotations], dtype=np.float64)
+    min_distance, max_distance = calculate_distances_to_objects(
+        drone_pitch=image["pitch"],
+        drone_relative_height=image["relative_altitude"],
+        image_y=y,
+        image_height=image["image_height"],
+        vertical_fov_deg=vertical_fov_deg,
+        MAXIMUM_OBJECT_HEIGHT=MAXIMUM_OBJECT_HEIGHT,
+    )
+    ranges = [
+        {"image": path, "x": x, "y": py, "min_distance": float(near), "max_distance": float(far)}
+        for (path, x, py), near, far in zip(annotations, min_distance, max_distance)
+    ]
+    if preview_dir is not None:
+        _write_previews(ranges, table, Path(preview_dir), preview_scale)
+    return ranges
+
+
+def _write_previews(ranges: list[dict], table: FlightTable, preview_dir: Path, scale: int):
+    """
+    Draws the annotations onto reduced resolution copies of the images
+    """
+    import cv2
+
+    flag = getattr(cv2, REDUCED_FLAGS[scale]) if scale in REDUCED_FLAGS else cv2.IMREAD_COLOR
+    preview_dir.mkdir(parents=True, exist_ok=True)
+    by_image: dict[str, list[dict]] = {}
+    for entry in ranges:
+        by_image.setdefault(entry["image"], []).append(entry)
+    for path, entries in by_image.items():
+        preview = cv2.imread(path, flag)
+        if preview is None:
+            instrumentation.count("previews_skipped")
+            logger.warning("Image at path '%s' could not be loaded.", path)
+            continue
+        # map full resolution pixels onto the decoded image
+        row = table.rows[table.index(path)]
+        fx = preview.shape[1] / row["image_width"]
+        fy = preview.shape[0] / row["image_height"]
+        for entry in entries:
+            point = (round(entry["x"] * fx), round(entry["y"] * fy))
+            cv2.circle(preview, point, 5, (0, 255, 0), -1)
+            cv2.putText(preview, f'{abs(entry["min_distance"]):.1f}-{abs(entry["max_distance"]):.1f} m',
+                        (point[0] + 8, point[1]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        cv2.imwrite(str(preview_dir / Path(path).name), preview)
+
+
+def write_ranges(ranges: list[dict], output_path: str | Path):
+    """
+    Writes the output of `estimate_ranges` as CSV
+    """
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["image", "x", "y", "min_distance", "max_distance"])
+        writer.writeheader()
+        writer.writerows(ranges)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimates the distance to annotated objects without a GUI.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="CSV file with image, x, y columns")
+    source.add_argument("--labels", help="folder with YOLO label files")
+    parser.add_argument("--images", help="folder with the images of the label files")
+    parser.add_argument("--anchor", default="center", choices=ANCHORS)
+    parser.add_argument("--output", default="ranges.csv")
+    parser.add_argument("--preview", help="folder for reduced resolution overlay previews")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.csv:
+        annotations = read_csv_annotations(args.csv)
+    else:
+        annotations = read_yolo_annotations(args.images or args.labels, args.labels, anchor=args.anchor)
+    write_ranges(estimate_ranges(annotations, preview_dir=args.preview), args.output)
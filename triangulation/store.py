@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from .geodesy import ecef_to_wgs84
+
+__all__ = [
+    "DETECTION_DTYPE",
+    "PAIR_DTYPE",
+    "POINT_DTYPE",
+    "WAYPOINT_DTYPE",
+    "TABLES",
+    "Run",
+    "ResultStore",
+]
+
+INDEX_NAME = "index.jsonl"
+SEGMENT_DIR = "segments"
+
+# every row carries its run id, so segments of many runs can be concatenated
+DETECTION_DTYPE = np.dtype([
+    ("run", np.int64),
+    ("image", np.int32),         # index into `Run.images`
+    ("box", np.float32, (4,)),   # xyxy in pixels
+    ("confidence", np.float32),
+    ("class", np.int16),
+])
+
+PAIR_DTYPE = np.dtype([
+    ("run", np.int64),
+    ("rank", np.int32),
+    ("image1", np.int32),
+    ("image2", np.int32),
+])
+
+POINT_DTYPE = np.dtype([
+    ("run", np.int64),
+    ("target", np.int32),
+    ("corner", np.int8),
+    ("ecef", np.float64, (3,)),
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("altitude", np.float64),
+])
+
+WAYPOINT_DTYPE = np.dtype([
+    ("run", np.int64),
+    ("index", np.int32),
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("altitude", np.float64),
+])
+
+TABLES = {
+    "detections": DETECTION_DTYPE,
+    "pairs": PAIR_DTYPE,
+    "points": POINT_DTYPE,
+    "waypoints": WAYPOINT_DTYPE,
+}
+
+
+@dataclass
+class Run:
+    """
+    One entry of the store index
+    """
+    run: int
+    flight: str
+    timestamp: float  # seconds since the epoch
+    images: list[str]
+    rows: dict[str, int]
+
+
+class ResultStore:
+    """
+    Append-only store for the results of pipeline runs.
+    Every run writes one NumPy segment per table (see `TABLES`) into its own
+    directory and is then added to a JSON lines index with its flight and
+    timestamp. Segments are never modified, so readers can memory-map them
+    while new runs are appended.
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._runs: list[Run] = []
+        self._index_size = 0
+        self._last_run = 0
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / INDEX_NAME
+
+    def _segment_path(self, run: int, table: str) -> Path:
+        return self.root / SEGMENT_DIR / f"{run:020d}" / f"{table}.npy"
+
+    def _next_run(self) -> int:
+        self._last_run = max(time.time_ns(), self._last_run + 1)
+        return self._last_run
+
+    def append(
+        self,
+        flight: str,
+        images: list[str] | None = None,
+        detections: list[np.ndarray] | None = None,
+        pairs: list[tuple[str, str]] | None = None,
+        points: np.ndarray | None = None,
+        waypoints: np.ndarray | None = None,
+        timestamp: float | None = None,
+    ) -> Run:
+        """
+        Appends the results of one run and returns its index entry.
+        - `detections[i]` holds the (n, 4) xyxy boxes of `images[i]`, optionally
+          followed by the confidence and class columns (like the detection cache).
+        - `pairs` are image paths in rank order, missing images are added to `images`.
+        - `points` are ECEF coordinates with shape (T, 3) or (T, C, 3), e.g. the
+          (top left, bottom right) corners of every target.
+        - `waypoints` are (latitude, longitude, altitude) rows as written to the KMZ.
+        """
+        images = [str(path) for path in images or []]
+        image_index = {path: i for i, path in enumerate(images)}
+        for pair in pairs or []:
+            for path in map(str, pair):
+                if path not in image_index:
+                    image_index[path] = len(images)
+                    images.append(path)
+
+        with self._lock:
+            run = self._next_run()
+        segments = {
+            "detections": self._detection_rows(run, detections or []),
+            "pairs": self._pair_rows(run, pairs or [], image_index),
+            "points": self._point_rows(run, points),
+            "waypoints": self._waypoint_rows(run, waypoints),
+        }
+        for table, rows in segments.items():
+            if len(rows):
+                path = self._segment_path(run, table)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(path.stem + ".tmp.npy")
+                np.save(tmp_path, rows)
+                os.replace(tmp_path, path)
+
+        entry = Run(
+            run=run,
+            flight=str(flight),
+            timestamp=time.time() if timestamp is None else float(timestamp),
+            images=images,
+            rows={table: len(rows) for table, rows in segments.items()},
+        )
+        # the run only becomes visible once all of its segments are complete
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.index_path, "a") as f:
+            f.write(json.dumps(asdict(entry)) + "\n")
+        return entry
+
+    @staticmethod
+    def _detection_rows(run: int, detections: list[np.ndarray]) -> np.ndarray:
+        counts = [len(boxes) for boxes in detections]
+        rows = np.zeros(sum(counts), dtype=DETECTION_DTYPE)
+        if not len(rows):
+            return rows
+        # boxes without confidence or class get NaN and -1
+        boxes = np.tile([0.0, 0.0, 0.0, 0.0, np.nan, -1.0], (len(rows), 1))
+        offset = 0
+        for b in detections:
+            b = np.asarray(b, dtype=np.float64)
+            if not b.size:
+                continue
+            b = b.reshape(len(b), -1)
+            boxes[offset:offset + len(b), :b.shape[1]] = b[:, :6]
+            offset += len(b)
+        rows["run"] = run
+        rows["image"] = np.repeat(np.arange(len(detections)), counts)
+        rows["box"] = boxes[:, :4]
+        rows["confidence"] = boxes[:, 4]
+        rows["class"] = boxes[:, 5]
+        return rows
+
+    @staticmethod
+    def _pair_rows(run: int, pairs: list[tuple[str, str]], image_index: dict[str, int]) -> np.ndarray:
+        rows = np.zeros(len(pairs), dtype=PAIR_DTYPE)
+        rows["run"] = run
+        rows["rank"] = np.arange(len(pairs))
+        rows["image1"] = [image_index[str(path1)] for path1, _ in pairs]
+        rows["image2"] = [image_index[str(path2)] for _, path2 in pairs]
+        return rows
+
+    @staticmethod
+    def _point_rows(run: int, points: np.ndarray | None) -> np.ndarray:
+        if points is None:
+            return np.zeros(0, dtype=POINT_DTYPE)
+        points = np.asarray(points, dtype=np.float64)
+        targets, corners = (len(points), 1) if points.ndim == 2 else points.shape[:2]
+        points = points.reshape(-1, 3)
+        rows = np.zeros(len(points), dtype=POINT_DTYPE)
+        if not len(rows):
+            return rows
+        wgs84 = ecef_to_wgs84(points)
+        rows["run"] = run
+        rows["target"] = np.repeat(np.arange(targets), corners)
+        rows["corner"] = np.tile(np.arange(corners), targets)
+        rows["ecef"] = points
+        rows["latitude"], rows["longitude"], rows["altitude"] = wgs84.T
+        return rows
+
+    @staticmethod
+    def _waypoint_rows(run: int, waypoints: np.ndarray | None) -> np.ndarray:
+        waypoints = np.zeros((0, 3)) if waypoints is None else np.asarray(waypoints, dtype=np.float64).reshape(-1, 3)
+        rows = np.zeros(len(waypoints), dtype=WAYPOINT_DTYPE)
+        rows["run"] = run
+        rows["index"] = np.arange(len(waypoints))
+        rows["latitude"], rows["longitude"], rows["altitude"] = waypoints.T
+        return rows
+
+    def runs(self, flight: str | None = None, start: float | None = None, end: float | None = None) -> list[Run]:
+        """
+        Returns the runs of `flight` (default: all) with a timestamp in [`start`, `end`).
+        Only the part of the index written since the last call is read.
+        """
+        with self._lock:
+            if self.index_path.exists():
+                with open(self.index_path, "rb") as f:
+                    f.seek(self._index_size)
+                    for line in f:
+                        # a line without newline is still being written
+                        if not line.endswith(b"\n"):
+                            break
+                        self._runs.append(Run(**json.loads(line)))
+                        self._index_size += len(line)
+            runs = list(self._runs)
+        return [
+            run for run in runs
+            if (flight is None or run.flight == flight)
+            and (start is None or run.timestamp >= start)
+            and (end is None or run.timestamp < end)
+        ]
+
+    def flights(self) -> list[str]:
+        """
+        Returns the names of all stored flights
+        """
+        return sorted({run.flight for run in self.runs()})
+
+    def segment(self, table: str, run: Run) -> np.ndarray:
+        """
+        Returns the rows of `table` written by `run`, memory-mapped read-only
+        """
+        if not run.rows.get(table):
+            return np.zeros(0, dtype=TABLES[table])
+        return np.load(self._segment_path(run.run, table), mmap_mode="r")
+
+    def load(self, table: str, flight: str | None = None, start: float | None = None, end: float | None = None) -> np.ndarray:
+        """
+        Returns the rows of `table` of all runs selected like in `runs`, as one array
+        """
+        segments = [self.segment(table, run) for run in self.runs(flight, start, end)]
+        return np.concatenate([np.zeros(0, dtype=TABLES[table])] + segments)
@@ -1,8 +1,6 @@
 import numpy as np
-import cv2
-from pyproj import Transformer
-from .metadata import DJIMetadata, read_metadata
-from scipy.spatial.transform import Rotation as R
+from .flight_table import FlightTable
+from .instrumentation import instrumentation
 
 # Camera calibration parameters (optimized values)
 OPTIMIZED_FOCAL_LENGTH: np.float64 = 2804.051
@@ -11,54 +9,133 @@ OPTIMIZED_CY: np.float64 = 1512.734
 DIST_COEFFS = np.array([0.116413456, -0.202624237, 0.136982457, 0.000004293, -0.000216595], dtype=np.float64)
 
 
-def compute_camera_matrix(metadata: DJIMetadata):
-    # Build K matrix using optimized intrinsics
-    K = np.array([
-        [OPTIMIZED_FOCAL_LENGTH, 0.0, OPTIMIZED_CX],
-        [0.0, OPTIMIZED_FOCAL_LENGTH, OPTIMIZED_CY],
-        [0.0, 0.0, 1.0]
-    ], dtype=np.float64)
-    # Convert GPS to ECEF (x, y, z)
-    transformer = Transformer.from_crs("epsg:4326", "epsg:4978", always_xy=True)
-    x, y, z = transformer.transform(
-        metadata.longitude,
-        metadata.latitude,
-        metadata.absolute_altitude
-    )
+# Build K matrix using optimized intrinsics
+K_MATRIX = np.array([
+    [OPTIMIZED_FOCAL_LENGTH, 0.0, OPTIMIZED_CX],
+    [0.0, OPTIMIZED_FOCAL_LENGTH, OPTIMIZED_CY],
+    [0.0, 0.0, 1.0]
+], dtype=np.float64)
 
-    # Use gimbal yaw, pitch, roll for rotation
-    r = R.from_euler('zyx', [metadata.yaw, metadata.pitch, metadata.roll], degrees=True)
-    R_cam = r.as_matrix()
 
-    # Compute translation vector
-    cam_position = np.array([x, y, z], dtype=np.float64)
-    t = -R_cam @ cam_position
+def compute_camera_matrices(table: FlightTable, rows=None):
+    """
+    Computes the projection matrices of all `rows` (default: all) of `table` at once.
+    Returns `P` with shape (N, 3, 4) and the shared `K`.
+    """
+    rows = slice(None) if rows is None else rows
+    R_cam = table.rotation[rows]
+    cam_position = table.ecef[rows]
+    t = -np.einsum('nij,nj->ni', R_cam, cam_position)
+    Rt = np.concatenate((R_cam, t[:, :, None]), axis=2)
+    P = K_MATRIX @ Rt
+    return P, K_MATRIX.copy()
 
-    # Combine into extrinsics
-    Rt = np.hstack((R_cam, t.reshape(3, 1)))
 
-    # Full projection matrix
-    P = K @ Rt
+def undistort_points(points: np.ndarray, K=K_MATRIX) -> np.ndarray:
+    """
+    Undistorts pixel coordinates with shape (N, 2) in a single call
+    """
+    import cv2
 
-    return P, K
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    if not len(points):
+        return points.reshape(0, 2)
+    return cv2.undistortPoints(points, K, DIST_COEFFS, P=K).reshape(-1, 2)
 
 
-def triangulate(img1_metadata: DJIMetadata, img2_metadata: DJIMetadata, label_pos1: tuple[int, int], label_pos2: tuple[int, int]):
-    P1, K1 = compute_camera_matrix(img1_metadata)
-    P2, K2 = compute_camera_matrix(img2_metadata)
+def _camera_centers(P: np.ndarray) -> np.ndarray:
+    # P = K [R | -R c]  =>  c = -M^-1 p4
+    return -np.linalg.solve(P[:, :, :3], P[:, :, 3:])[..., 0]
 
-    # Convert label positions into (N, 1, 2) shape arrays
-    pt1 = np.array(label_pos1, dtype=np.float64).reshape(1, 1, 2)
-    pt2 = np.array(label_pos2, dtype=np.float64).reshape(1, 1, 2)
 
-    # Undistort points based on calibration
-    undist_pt1 = cv2.undistortPoints(pt1, K1, DIST_COEFFS, P=K1).reshape(2, 1)
-    undist_pt2 = cv2.undistortPoints(pt2, K2, DIST_COEFFS, P=K2).reshape(2, 1)
+def _translate(P: np.ndarray, origin: np.ndarray) -> np.ndarray:
+    # projection matrices for points given relative to `origin`
+    P = P.copy()
+    P[:, :, 3] += P[:, :, :3] @ origin
+    return P
 
-    # Triangulate
-    pts4D_hom = cv2.triangulatePoints(P1, P2, undist_pt1, undist_pt2)
 
-    # Convert from homogeneous to Euclidean coordinates
-    pts3D = (pts4D_hom[:3] / pts4D_hom[3]).reshape(3,)
+def triangulate_multiview(P: np.ndarray, pts: np.ndarray, mask: np.ndarray | None = None) -> np.ndarray:
+    """
+    Least-squares triangulation of N points from up to V views each.
+    `P` has shape (N, V, 3, 4), `pts` are undistorted pixels with shape (N, V, 2)
+    and `mask` (N, V) marks the views that observed the point (default: all).
+    The DLT constraints of all views of a point are stacked into one system
+    and solved with a single batched SVD. Returns the points with shape (N, 3).
+    """
+    if mask is None:
+        mask = np.ones(P.shape[:2], dtype=bool)
+    instrumentation.count("triangulations", len(P))
+    # move the origin close to the cameras, ECEF coordinates are badly conditioned
+    origin = _camera_centers(P[mask]).mean(axis=0)
+    P = _translate(P.reshape(-1, 3, 4), origin).reshape(P.shape)
+    A = np.stack((
+        pts[..., 0, None] * P[..., 2, :] - P[..., 0, :],
+        pts[..., 1, None] * P[..., 2, :] - P[..., 1, :],
+    ), axis=2)
+    # unobserved views contribute zero rows
+    A = np.where(mask[..., None, None], A, 0.0).reshape(len(P), -1, 4)
+    X = np.linalg.svd(A)[2][:, -1]
+    return X[:, :3] / X[:, 3:] + origin
 
-    return pts3D
\ No newline at end of file
+
+def solve_observations(P: np.ndarray, pts: np.ndarray, point_ids, n_points=None) -> np.ndarray:
+    """
+    Least-squares triangulation of points from any number of observations.
+    Observation `k` sees point `point_ids[k]` at the undistorted pixel `pts[k]`
+    in the image with projection matrix `P[k]` (shape (N, 3, 4)).
+    Every point needs at least two observations.
+    Returns the ECEF points with shape (n_points, 3).
+    """
+    point_ids = np.asarray(point_ids, dtype=np.intp)
+    n_points = point_ids.max() + 1 if n_points is None else n_points
+    if not n_points:
+        return np.zeros((0, 3), dtype=np.float64)
+
+    # slot of every observation within its point
+    order = np.argsort(point_ids, kind='stable')
+    counts = np.bincount(point_ids, minlength=n_points)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    slots = np.empty(len(point_ids), dtype=np.intp)
+    slots[order] = np.arange(len(point_ids)) - starts[point_ids[order]]
+
+    views = max(counts.max(), 2)
+    P_points = np.zeros((n_points, views, 3, 4), dtype=np.float64)
+    uv = np.zeros((n_points, views, 2), dtype=np.float64)
+    mask = np.zeros((n_points, views), dtype=bool)
+    P_points[point_ids, slots] = P
+    uv[point_ids, slots] = pts
+    mask[point_ids, slots] = True
+    return triangulate_multiview(P_points, uv, mask)
+
+
+def triangulate_observations(table: FlightTable, point_ids, rows, pts, n_points=None) -> np.ndarray:
+    """
+    Triangulates points from any number of observations.
+    Observation `k` sees point `point_ids[k]` at pixel `pts[k]` in image `rows[k]`
+    of `table`. Every point needs at least two observations.
+    Returns the ECEF points with shape (n_points, 3).
+    """
+    point_ids = np.asarray(point_ids, dtype=np.intp)
+    rows = np.asarray(rows, dtype=np.intp)
+    n_points = point_ids.max() + 1 if n_points is None else n_points
+    if not n_points:
+        return np.zeros((0, 3), dtype=np.float64)
+
+    images, inverse = np.unique(rows, return_inverse=True)
+    P_images, K = compute_camera_matrices(table, images)
+    return solve_observations(P_images[inverse], undistort_points(pts, K), point_ids, n_points)
+
+
+def triangulate_many(table: FlightTable, rows1, rows2, pts1, pts2) -> np.ndarray:
+    """
+    Triangulates N point correspondences at once.
+    Point `k` is seen at pixel `pts1[k]` in image `rows1[k]` and at `pts2[k]`
+    in image `rows2[k]` of `table`, see `triangulate_observations`.
+    Returns the ECEF points with shape (N, 3).
+    """
+    n = len(rows1)
+    point_ids = np.tile(np.arange(n), 2)
+    rows = np.concatenate((np.asarray(rows1, dtype=np.intp), np.asarray(rows2, dtype=np.intp)))
+    pts = np.concatenate((np.asarray(pts1, dtype=np.float64).reshape(-1, 2), np.asarray(pts2, dtype=np.float64).reshape(-1, 2)))
+    return triangulate_observations(table, point_ids, rows, pts, n_points=n)
@@ -1,7 +1,13 @@
 import math
-import cv2
+import numpy as np
 
-from metadata import read_metadata
+from .metadata import read_metadata
+from .flight_table import FlightTable
+
+# vertical field of view of the camera in degrees
+VERTICAL_FOV_DEG = 67
+# mean earth radius in meters, as used by `move_point`
+EARTH_RADIUS = 6371000
 
 def calculate_object_angle(
     object_pixel_y,
@@ -56,6 +62,8 @@ def select_pixel_and_calculate_distance(image_path: str) -> tuple[float, float]:
     Opens an image, lets the user select a pixel, reads the metadata,
     and calculates the distance to the object.
     """
+    import cv2
+
     # Load image
     image = cv2.imread(image_path)
     if image is None:
@@ -98,7 +106,7 @@ def select_pixel_and_calculate_distance(image_path: str) -> tuple[float, float]:
         drone_relative_height=metadata.relative_altitude,
         image_y=y_pixel,
         image_height=metadata.image_height,
-        vertical_fov_deg=67,
+        vertical_fov_deg=VERTICAL_FOV_DEG,
         MAXIMUM_OBJECT_HEIGHT=2.6,
     )
 
@@ -111,7 +119,7 @@ def move_point(lat, lon, yaw, distance_m):
     and yaw.
     """
     # Earth radius in meters
-    R = 6371000
+    R = EARTH_RADIUS
 
     # Convert inputs to radians
     lat_rad = math.radians(lat)
@@ -133,3 +141,93 @@ def move_point(lat, lon, yaw, distance_m):
     new_lon = math.degrees(new_lon_rad)
 
     return new_lat, new_lon
+
+
+def calculate_object_angles(object_pixel_y, image_height, vertical_fov_deg, gimbal_pitch_deg) -> np.ndarray:
+    """
+    Array version of `calculate_object_angle`, all arguments broadcast
+    """
+    object_pixel_y = np.asarray(object_pixel_y, dtype=np.float64)
+    image_height = np.asarray(image_height, dtype=np.float64)
+    delta_y_angle = (object_pixel_y - image_height / 2) * vertical_fov_deg / image_height
+    return np.asarray(gimbal_pitch_deg, dtype=np.float64) + delta_y_angle
+
+
+def calculate_distances_to_objects(
+        drone_pitch,
+        drone_relative_height,
+        image_y,
+        image_height,
+        vertical_fov_deg: float,
+        MAXIMUM_OBJECT_HEIGHT=2.6,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of `calculate_distance_to_object`, all arguments broadcast.
+    Returns the minimum and maximum possible distances to the objects.
+    """
+    object_pitch = calculate_object_angles(image_y, image_height, vertical_fov_deg, drone_pitch)
+    tan_pitch = np.tan(np.radians(object_pitch))
+    drone_relative_height = np.asarray(drone_relative_height, dtype=np.float64)
+    return (
+        drone_relative_height / tan_pitch,
+        (drone_relative_height - MAXIMUM_OBJECT_HEIGHT) / tan_pitch,
+    )
+
+
+def move_points(lat, lon, yaw, distance_m) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of `move_point`, all arguments broadcast
+    """
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+    heading_rad = np.radians(yaw)
+    angular_distance = np.asarray(distance_m, dtype=np.float64) / EARTH_RADIUS
+
+    new_lat_rad = np.arcsin(np.sin(lat_rad) * np.cos(angular_distance) +
+                            np.cos(lat_rad) * np.sin(angular_distance) * np.cos(heading_rad))
+    new_lon_rad = lon_rad + np.arctan2(
+        np.sin(heading_rad) * np.sin(angular_distance) * np.cos(lat_rad),
+        np.cos(angular_distance) - np.sin(lat_rad) * np.sin(new_lat_rad)
+    )
+    return np.degrees(new_lat_rad), np.degrees(new_lon_rad)
+
+
+def geolocate_detections(
+        table: FlightTable,
+        rows,
+        pixel_y,
+        vertical_fov_deg=VERTICAL_FOV_DEG,
+        MAXIMUM_OBJECT_HEIGHT=2.6,
+) -> dict[str, np.ndarray]:
+    """
+    Single-image geolocation of many detections at once.
+    Detection `k` was seen at pixel row `pixel_y[k]` in image `rows[k]` of `table`.
+    Uses the gimbal pitch, relative altitude and yaw of every image to
+    compute the ground range to the object and projects it along the yaw.
+    Useful as a fallback for images that could not be paired.
+    Returns the minimum/maximum distances and the projected positions
+    (`latitude`/`longitude` at the mean distance). Rays at or above the
+    horizon never reach the ground, their distances and positions are NaN.
+    """
+    image = table.rows[np.asarray(rows, dtype=np.intp)]
+    object_pitch = calculate_object_angles(pixel_y, image["image_height"], vertical_fov_deg, image["pitch"])
+    distances = calculate_distances_to_objects(
+        drone_pitch=image["pitch"],
+        drone_relative_height=image["relative_altitude"],
+        image_y=pixel_y,
+        image_height=image["image_height"],
+        vertical_fov_deg=vertical_fov_deg,
+        MAXIMUM_OBJECT_HEIGHT=MAXIMUM_OBJECT_HEIGHT,
+    )
+    # the camera looks down, so the pitch angle and with it the distances are negative
+    distances = np.where(object_pitch < 0, -np.asarray(distances), np.nan)
+    min_distance, max_distance = distances.min(axis=0), distances.max(axis=0)
+    latitude, longitude = move_points(
+        image["latitude"], image["longitude"], image["yaw"], (min_distance + max_distance) / 2
+    )
+    return {
+        "min_distance": min_distance,
+        "max_distance": max_distance,
+        "latitude": latitude,
+        "longitude": longitude,
+    }
@@ -1,59 +1,202 @@
 import json
+import numpy as np
 import plotly.graph_objects as go
 
-# Load data from JSON file
-with open('result.json', 'r') as f:
-    data = json.load(f)
+from .store import ResultStore
 
-special_point = data['result']
-points = data['points']
+__all__ = [
+    "all_segments",
+    "cluster_points",
+    "points_figure",
+    "plot_result_file",
+    "plot_store",
+]
 
-# Combine all points (normal + special) into one list
-all_points = points + [special_point]
-special_point_idx = len(points)  # it's the last one
 
-# Create figure
-fig = go.Figure()
+def all_segments(n: int) -> np.ndarray:
+    """
+    Returns the (M, 2) indices of all pairs of `n` points
+    """
+    return np.column_stack(np.triu_indices(n, k=1))
 
-# Add all points
-for idx, point in enumerate(all_points):
-    fig.add_trace(go.Scattermapbox(
-        lat=[point["latitude"]],
-        lon=[point["longitude"]],
-        mode='markers',
-        marker=go.scattermapbox.Marker(
-            size=12,
-            color='red' if idx == special_point_idx else 'blue'
-        ),
-        name=point["name"] + (" (Special)" if idx == special_point_idx else ""),
-        text=f'{point["name"]}<br>Altitude: {point["altitude"]} m',
-        hoverinfo='text'
-    ))
 
-# Add lines between all pairs of points
-for i in range(len(all_points)):
-    for j in range(i + 1, len(all_points)):
+def cluster_points(latitude, longitude, max_points: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merges points on a regular latitude/longitude grid until at most
+    `max_points` cells are occupied. The cell size starts at the extent
+    divided by sqrt(`max_points`) and grows by sqrt(2) as needed.
+    Returns the mean latitude and longitude and the size of every cluster,
+    and the cluster of every input point.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    if len(latitude) <= max_points:
+        return latitude, longitude, np.ones(len(latitude), dtype=np.intp), np.arange(len(latitude))
+
+    origin = np.array([latitude.min(), longitude.min()])
+    extent = max(latitude.max() - origin[0], longitude.max() - origin[1], 1e-9)
+    cell = extent / np.sqrt(max_points)
+    coordinates = np.column_stack((latitude, longitude)) - origin
+    while True:
+        cells = np.floor(coordinates / cell).astype(np.int64)
+        _, labels = np.unique(cells, axis=0, return_inverse=True)
+        labels = labels.reshape(-1)
+        if labels.max() < max_points:
+            break
+        cell *= np.sqrt(2)
+
+    counts = np.bincount(labels)
+    return (
+        np.bincount(labels, weights=latitude) / counts,
+        np.bincount(labels, weights=longitude) / counts,
+        counts,
+        labels,
+    )
+
+
+def _line_coordinates(values: np.ndarray, segments: np.ndarray) -> list:
+    # (start, end, gap) per segment, None breaks the line between segments
+    lines = np.full((len(segments), 3), None, dtype=object)
+    lines[:, 0] = values[segments[:, 0]].tolist()
+    lines[:, 1] = values[segments[:, 1]].tolist()
+    return lines.reshape(-1).tolist()
+
+
+def points_figure(
+    latitude,
+    longitude,
+    altitude=None,
+    names: list[str] | None = None,
+    segments: np.ndarray | str | None = None,
+    special: int | None = None,
+    max_points: int | None = None,
+    title="Points Visualization with Special Highlight",
+) -> go.Figure:
+    """
+    Plots points on a map with one marker trace for all points and
+    one line trace for all `segments` ((M, 2) point indices, or "all" to
+    connect every pair of plotted points).
+    The point with index `special` is highlighted.
+    If `max_points` is given, the points other than `special` are first merged
+    with `cluster_points`, segments then connect clusters and duplicates are dropped.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    n = len(latitude)
+    names = [str(i) for i in range(n)] if names is None else names
+    text = (
+        names if altitude is None
+        else [f"{name}<br>Altitude: {alt} m" for name, alt in zip(names, altitude)]
+    )
+    connect_all = isinstance(segments, str) and segments == "all"
+    segments = (
+        np.zeros((0, 2), dtype=np.intp) if segments is None or connect_all
+        else np.asarray(segments, dtype=np.intp).reshape(-1, 2)
+    )
+    center = dict(lat=float(latitude.mean()), lon=float(longitude.mean()))
+    markers = np.ones(n, dtype=bool)
+    if special is not None:
+        special_point = (latitude[special], longitude[special], f"{names[special]} (Special)", text[special])
+        markers[special] = False
+
+    if max_points is not None and n > max_points:
+        # the special point keeps its own marker and is never merged
+        clustered = np.flatnonzero(markers)
+        lat, lon, counts, labels = cluster_points(latitude[clustered], longitude[clustered], max_points)
+        first = np.full(len(counts), -1, dtype=np.intp)
+        first[labels[::-1]] = clustered[::-1]
+        text = [text[i] if count == 1 else f"{count} points" for i, count in zip(first, counts)]
+        point_of = np.empty(n, dtype=np.intp)
+        point_of[clustered] = labels
+        markers = np.ones(len(counts), dtype=bool)
+        if special is not None:
+            point_of[special] = len(counts)
+            lat, lon = np.append(lat, special_point[0]), np.append(lon, special_point[1])
+            text.append(special_point[3])
+            markers = np.append(markers, False)
+        segments = point_of[segments]
+        segments = np.unique(np.sort(segments[segments[:, 0] != segments[:, 1]], axis=1), axis=0)
+        latitude, longitude = lat, lon
+    if connect_all:
+        segments = all_segments(len(latitude))
+
+    fig = go.Figure()
+    if len(segments):
         fig.add_trace(go.Scattermapbox(
-            lat=[all_points[i]["latitude"], all_points[j]["latitude"]],
-            lon=[all_points[i]["longitude"], all_points[j]["longitude"]],
+            lat=_line_coordinates(latitude, segments),
+            lon=_line_coordinates(longitude, segments),
             mode='lines',
             line=dict(width=2, color='green'),
+            hoverinfo='skip',
             showlegend=False
         ))
+    fig.add_trace(go.Scattermapbox(
+        lat=latitude[markers],
+        lon=longitude[markers],
+        mode='markers',
+        marker=go.scattermapbox.Marker(size=12, color='blue'),
+        name="Points",
+        text=[t for t, keep in zip(text, markers) if keep],
+        hoverinfo='text'
+    ))
+    if special is not None:
+        fig.add_trace(go.Scattermapbox(
+            lat=[special_point[0]],
+            lon=[special_point[1]],
+            mode='markers',
+            marker=go.scattermapbox.Marker(size=12, color='red'),
+            name=special_point[2],
+            text=special_point[3],
+            hoverinfo='text'
+        ))
+    fig.update_layout(
+        mapbox=dict(
+            style="open-street-map",
+            zoom=1.5,
+            center=center
+        ),
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        title=title
+    )
+    return fig
+
+
+def plot_result_file(path="result.json", max_points: int | None = 100) -> go.Figure:
+    """
+    Plots a result file with the `points` and the `result` point,
+    connecting every pair of points. The points are clustered down to
+    `max_points` markers first, which bounds the number of segments.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    all_points = data['points'] + [data['result']]
+    return points_figure(
+        [p["latitude"] for p in all_points],
+        [p["longitude"] for p in all_points],
+        altitude=[p["altitude"] for p in all_points],
+        names=[p["name"] for p in all_points],
+        segments="all",
+        special=len(all_points) - 1,
+        max_points=max_points,
+    )
+
+
+def plot_store(store: ResultStore, flight: str | None = None, start: float | None = None, end: float | None = None,
+               max_points: int | None = 5000) -> go.Figure:
+    """
+    Plots the triangulated points of the runs in `store` selected like in
+    `ResultStore.runs`, clustered down to `max_points` markers
+    """
+    points = store.load("points", flight=flight, start=start, end=end)
+    return points_figure(
+        points["latitude"],
+        points["longitude"],
+        altitude=np.round(points["altitude"], 1),
+        names=[f"Run {run}, target {target}" for run, target in zip(points["run"], points["target"])],
+        max_points=max_points,
+        title="Triangulated targets",
+    )
+
 
-# Set layout
-fig.update_layout(
-    mapbox=dict(
-        style="open-street-map",
-        zoom=1.5,
-        center=dict(
-            lat=sum(p['latitude'] for p in all_points) / len(all_points),
-            lon=sum(p['longitude'] for p in all_points) / len(all_points)
-        )
-    ),
-    margin={"r": 0, "t": 0, "l": 0, "b": 0},
-    title="Points Visualization with Special Highlight"
-)
-
-# Show the figure
-fig.show()
+if __name__ == "__main__":
+    plot_result_file().show()
@@ -0,0 +1,170 @@
+import re
+import struct
+from pathlib import Path
+from typing import Iterator
+
+__all__ = [
+    "read_xmp_fields",
+    "read_jpeg_size",
+]
+
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+EXIF_HEADER = b"Exif\x00\x00"
+
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+APP1 = 0xE1
+# start of frame markers, the others in 0xC0-0xCF are DHT, JPG and DAC
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# markers without a length field
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+# EXIF tags that exempi merges into the XMP data as `exif:` properties
+EXIF_IFD_POINTER = 0x8769
+EXIF_TAGS = {
+    0x920A: "exif:FocalLength",
+    0xA002: "exif:PixelXDimension",
+    0xA003: "exif:PixelYDimension",
+}
+# TIFF field types
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+
+# XMP properties are written either as attributes (`prefix:Name="value"`)
+# or as simple elements (`<prefix:Name>value</prefix:Name>`)
+ATTRIBUTE_PATTERN = re.compile(rb'\b(drone-dji|exif):(\w+)="([^"]*)"')
+ELEMENT_PATTERN = re.compile(rb'<(drone-dji|exif):(\w+)>([^<]*)</\1:\2>')
+
+
+def _iter_segments(f) -> Iterator[tuple[int, int]]:
+    """
+    Yields the marker code and payload length of every JPEG segment in front
+    of the image data. The file is positioned at the start of the payload,
+    payloads that are not read by the consumer are skipped.
+    """
+    if f.read(2) != b"\xff\xd8":
+        return
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return
+        code = marker[1]
+        # fill bytes may precede a marker
+        while code == 0xFF:
+            next_byte = f.read(1)
+            if not next_byte:
+                return
+            code = next_byte[0]
+        if code in STANDALONE_MARKERS:
+            continue
+        if code in (SOS, EOI):
+            return
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return
+        (length,) = struct.unpack(">H", length_bytes)
+        start = f.tell()
+        yield code, length - 2
+        f.seek(start + length - 2)
+
+
+def read_jpeg_size(file_path: str | Path) -> tuple[int, int] | None:
+    """
+    Returns the (width, height) of a JPEG file from its frame header,
+    without decoding it. Returns None for other files.
+    """
+    with open(file_path, "rb") as f:
+        for code, length in _iter_segments(f):
+            if code in SOF_MARKERS and length >= 5:
+                _, height, width = struct.unpack(">BHH", f.read(5))
+                return width, height
+    return None
+
+
+def _read_ifd(tiff: bytes, offset: int, order: str) -> dict[int, tuple[int, bytes]]:
+    """
+    Returns the type and the raw 4 byte value (or offset) of every entry
+    of the TIFF image file directory at `offset`
+    """
+    (count,) = struct.unpack_from(order + "H", tiff, offset)
+    entries = {}
+    for i in range(count):
+        tag, kind, _, value = struct.unpack_from(order + "HHI4s", tiff, offset + 2 + 12 * i)
+        entries[tag] = (kind, value)
+    return entries
+
+
+def _ifd_value(tiff: bytes, kind: int, value: bytes, order: str) -> str | None:
+    # formatted like exempi does, rationals stay fractions
+    if kind == SHORT:
+        return str(struct.unpack_from(order + "H", value)[0])
+    if kind == LONG:
+        return str(struct.unpack_from(order + "I", value)[0])
+    if kind == RATIONAL:
+        (offset,) = struct.unpack(order + "I", value)
+        numerator, denominator = struct.unpack_from(order + "II", tiff, offset)
+        return f"{numerator}/{denominator}"
+    return None
+
+
+def _parse_exif(payload: bytes) -> dict[str, str]:
+    tiff = payload[len(EXIF_HEADER):]
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return {}
+    # a truncated or broken block only drops the entries that cannot be read
+    try:
+        (ifd_offset,) = struct.unpack_from(order + "I", tiff, 4)
+        entries = _read_ifd(tiff, ifd_offset, order)
+        if EXIF_IFD_POINTER in entries:
+            (exif_offset,) = struct.unpack(order + "I", entries[EXIF_IFD_POINTER][1])
+            entries.update(_read_ifd(tiff, exif_offset, order))
+    except struct.error:
+        return {}
+    fields = {}
+    for tag, name in EXIF_TAGS.items():
+        try:
+            value = _ifd_value(tiff, *entries[tag], order) if tag in entries else None
+        except struct.error:
+            value = None
+        if value is not None:
+            fields[name] = value
+    return fields
+
+
+def _parse_xmp(packet: bytes) -> dict[str, str]:
+    fields = {}
+    for pattern in (ATTRIBUTE_PATTERN, ELEMENT_PATTERN):
+        for prefix, name, value in pattern.findall(packet):
+            fields[f"{prefix.decode()}:{name.decode()}"] = value.decode().strip()
+    return fields
+
+
+def read_xmp_fields(file_path: str | Path) -> dict[str, str]:
+    """
+    Returns all `drone-dji:` and `exif:` properties of `file` the way exempi
+    reports them, keyed by their prefixed name: the properties of the XMP
+    packet, merged with the `EXIF_TAGS` of the EXIF block (DJI cameras only
+    write the `drone-dji:` properties into XMP). The image size falls back
+    to the frame header. All segments are read in a single pass.
+    """
+    xmp_fields: dict[str, str] = {}
+    exif_fields: dict[str, str] = {}
+    size_fields: dict[str, str] = {}
+    with open(file_path, "rb") as f:
+        for code, length in _iter_segments(f):
+            if code == APP1:
+                payload = f.read(length)
+                if payload.startswith(XMP_HEADER):
+                    xmp_fields.update(_parse_xmp(payload[len(XMP_HEADER):]))
+                elif payload.startswith(EXIF_HEADER):
+                    exif_fields.update(_parse_exif(payload))
+            elif code in SOF_MARKERS and length >= 5:
+                _, height, width = struct.unpack(">BHH", f.read(5))
+                size_fields = {"exif:PixelXDimension": str(width), "exif:PixelYDimension": str(height)}
+    return {**size_fields, **exif_fields, **xmp_fields}
@@ -0,0 +1,186 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from inference import Detection, load_backend, list_images, BACKENDS
+from detection_cache import DetectionCache
+from object_detection import (
+    detect_images,
+    filter_results_by_object_num,
+    iter_ranked_pairs,
+    to_image_pairs,
+)
+from triangulation.flight_table import FlightTable
+from triangulation.instrumentation import instrumentation
+from triangulation.main import write_flight_plan
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalPairer:
+    """
+    Keeps the detections and candidate pairs of a growing flight.
+    Every added detection is only compared against the images that
+    were added before, using the same criteria as `create_pairs`.
+    """
+
+    def __init__(self, min_distance=0, max_distance=10, tol=0, min_num=1):
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.tol = tol
+        self.min_num = min_num
+        self.detections: List[Detection] = []
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros((0, 3), dtype=np.float64)
+        self.pairs: List[Tuple[Detection, Detection]] = []
+
+    def add(self, detection: Detection, position: np.ndarray | None = None) -> int:
+        """
+        Adds a detection and returns the number of new candidate pairs.
+        The ECEF `position` of the camera is read from the image if omitted.
+        """
+        if not filter_results_by_object_num([detection], min_num=self.min_num):
+            return 0
+        if position is None:
+            position = FlightTable.from_paths([detection.path]).ecef[0]
+
+        distances = np.linalg.norm(self.positions - position, axis=1)
+        matches = np.flatnonzero(
+            (np.abs(self.counts - len(detection)) <= self.tol)
+            & (distances >= self.min_distance)
+            & (distances <= self.max_distance)
+        )
+        self.pairs.extend((self.detections[i], detection) for i in matches)
+
+        self.detections.append(detection)
+        self.counts = np.append(self.counts, len(detection))
+        self.positions = np.vstack((self.positions, position))
+        return len(matches)
+
+    def ranking(self, top_k=None) -> List[Tuple[Detection, Detection]]:
+        """
+        Returns the `top_k` best pairs (default: all), ranked like in `get_image_pairs`
+        """
+        return list(iter_ranked_pairs(self.pairs, top_k=top_k))
+
+
+def _pair_key(pair: Tuple[Detection, Detection]) -> Tuple[str, str]:
+    return pair[0].path, pair[1].path
+
+
+def watch_folder(
+    folder_path: str,
+    model_path: str,
+    output_file="output.kmz",
+    backend="torch",
+    threads=None,
+    poll_interval=2.0,
+    max_idle=None,
+):
+    """
+    Watches `folder_path` for new images and updates the flight plan as they arrive.
+    An image is processed once its size did not change between two polls.
+    Pairs are only formed between the new image and the images seen before,
+    and `output_file` is only rewritten when the top-ranked pair changes.
+    Images that cannot be detected or read are logged and skipped, a pair
+    whose plan cannot be written is logged and the next best pair is used.
+    Stops after `max_idle` seconds without new images (default: never).
+    Returns the paths of the skipped images.
+    """
+    folder = Path(folder_path)
+    model = load_backend(model_path, backend=backend, threads=threads)
+    cache = DetectionCache.for_folder(folder)
+    pairer = IncrementalPairer()
+
+    seen: set[str] = set()
+    skipped: set[str] = set()
+    failed_pairs: set[Tuple[str, str]] = set()
+    pending: dict[str, int] = {}
+    top_pair = None
+    last_activity = time.monotonic()
+
+    while max_idle is None or time.monotonic() - last_activity < max_idle:
+        ready = []
+        for path in list_images(folder):
+            if path in seen:
+                continue
+            try:
+                size = Path(path).stat().st_size
+            except OSError:
+                # deleted again before it was complete
+                pending.pop(path, None)
+                continue
+            # wait until the upload of the file is complete
+            if pending.get(path) == size:
+                ready.append(path)
+                del pending[path]
+            else:
+                pending[path] = size
+
+        if ready:
+            last_activity = time.monotonic()
+            seen.update(ready)
+            new_pairs = 0
+            for path in ready:
+                try:
+                    for detection in detect_images([path], model_path, backend=backend, cache=cache, model=model):
+                        new_pairs += pairer.add(detection)
+                except Exception as e:
+                    skipped.add(path)
+                    instrumentation.count("images_skipped")
+                    logger.warning("Skipping %s: %s: %s", path, type(e).__name__, e)
+            logger.info("Processed %d new images, %d new pairs", len(ready), new_pairs)
+
+            if new_pairs:
+                top_pair = _write_best_pair(pairer, folder, output_file, top_pair, failed_pairs)
+        elif pending:
+            last_activity = time.monotonic()
+
+        time.sleep(poll_interval)
+    return skipped
+
+
+def _write_best_pair(
+    pairer: IncrementalPairer,
+    folder: Path,
+    output_file: str,
+    top_pair: Tuple[str, str] | None,
+    failed_pairs: set[Tuple[str, str]],
+) -> Tuple[str, str] | None:
+    """
+    Writes the plan of the best pair that did not fail before, if it is not `top_pair`.
+    Returns the key of the pair the current plan was written from.
+    """
+    for best in iter_ranked_pairs(pairer.pairs):
+        key = _pair_key(best)
+        if key in failed_pairs:
+            continue
+        if key == top_pair:
+            return top_pair
+        try:
+            write_flight_plan(to_image_pairs([best], folder), output_file)
+        except Exception as e:
+            failed_pairs.add(key)
+            instrumentation.count("plans_failed")
+            logger.warning("Cannot plan pair %s, %s: %s: %s", *key, type(e).__name__, e)
+            continue
+        logger.info("New top pair: %s, %s", *key)
+        return key
+    return top_pair
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the flight plan live while images arrive.")
+    parser.add_argument("folder", help="folder the drone uploads images to")
+    parser.add_argument("--model", default="model/best.pt")
+    parser.add_argument("--output", default="output.kmz")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    watch_folder(args.folder, args.model, args.output, backend=args.backend,
+                 threads=args.threads, poll_interval=args.poll_interval)